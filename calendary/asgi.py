@@ -3,6 +3,12 @@ ASGI config for calendary project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The messenger SSE stream (messenger:stream) keeps one coroutine per open
+connection and publishes new messages through an in-process broker, so it
+must be served from here with a single worker process, e.g.:
+
+    uvicorn calendary.asgi:application --workers 1
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -81,14 +81,76 @@ WSGI_APPLICATION = "calendary.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# PRAGMAs que se aplican a cada conexión nueva de SQLite. WAL deja leer mientras otro
+# escribe; busy_timeout espera al bloqueo en lugar de fallar con "database is locked";
+# synchronous=NORMAL es seguro con WAL (sólo se puede perder la última transacción si
+# se va la luz, nunca corromper el fichero); mmap_size, cache_size (negativo = KiB) y
+# temp_store evitan lecturas y ficheros temporales en disco. Cada valor se puede
+# cambiar con una variable de entorno SQLITE_<NOMBRE>, y un valor vacío lo omite
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "busy_timeout": "5000",
+    "synchronous": "NORMAL",
+    "mmap_size": str(128 * 1024 * 1024),
+    "cache_size": "-20000",
+    "temp_store": "MEMORY",
+}
+SQLITE_PRAGMAS = {
+    name: os.getenv(f"SQLITE_{name.upper()}", value) for name, value in SQLITE_PRAGMAS.items()
+}
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": {
+            "init_command": ";".join(
+                f"PRAGMA {name}={value}" for name, value in SQLITE_PRAGMAS.items() if value
+            ),
+            # Las transacciones piden el bloqueo de escritura al empezar: así esperan
+            # (busy_timeout) en lugar de fallar al pasar de lectura a escritura, que en
+            # WAL da "database is locked" sin esperar. También lo piden las atómicas que
+            # sólo leen; las lecturas fuera de atomic() no se ven afectadas
+            "transaction_mode": os.getenv("SQLITE_TRANSACTION_MODE", "IMMEDIATE") or None,
+        },
     }
 }
 
 
+# Caché (feeds del calendario). LocMem no necesita servicios externos, así que
+# la aplicación sigue funcionando sin conexión.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "calendary",
+    },
+    # Sesiones con SESSION_MODE = "cache". Con varios procesos tiene que ser una caché
+    # compartida (Redis, Memcached...): LocMem es de cada proceso
+    "sessions": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "calendary-sessions",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
+# Dónde se guardan las sesiones. Con "db" cada login, logout o paso del restablecimiento
+# de contraseña escribe en django_session, en el mismo fichero SQLite que eventos y
+# mensajes. "cookie" las guarda firmadas en la propia cookie (sin escrituras, pero se ven
+# en el navegador y un logout no invalida copias anteriores de la cookie). "cache" las
+# guarda en CACHES["sessions"] con la base de datos de respaldo (registration.sessions)
+SESSION_MODE = os.getenv("SESSION_MODE", "db")
+SESSION_ENGINE = {
+    "db": "django.contrib.sessions.backends.db",
+    "cookie": "django.contrib.sessions.backends.signed_cookies",
+    "cache": "registration.sessions",
+}[SESSION_MODE]
+SESSION_CACHE_ALIAS = "sessions"
+# Con SESSION_MODE = "cache", leer también de django_session las sesiones que no estén
+# en la caché. Sólo hace falta durante el cambio desde "db" (hasta que caduquen las
+# sesiones anteriores, SESSION_COOKIE_AGE); cuesta una consulta por cada fallo de caché
+SESSION_CACHE_READ_DB = os.getenv("SESSION_CACHE_READ_DB", "") == "1"
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -154,3 +216,31 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # Django usará mi modelo de usuario personalizado
 AUTH_USER_MODEL = 'registration.CustomUser'
+
+# El usuario de cada petición se carga con su perfil en una sola consulta. ModelBackend
+# se mantiene detrás porque las sesiones guardan la ruta del backend con el que se
+# inició sesión: sin él, las sesiones abiertas antes del cambio dejarían de valer
+AUTHENTICATION_BACKENDS = [
+    "registration.backends.ProfileBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+
+# Segundos que se guarda en la caché el usuario (con su perfil) de cada sesión; 0 lo
+# desactiva. Se invalida al guardar el usuario o el perfil, pero con LocMem sólo en el
+# proceso que lo guarda, así que conviene que sea corto
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv("AUTH_USER_CACHE_TIMEOUT", "0"))
+
+# Retención de mensajes: compact_messages pasa al archivo comprimido de cada hilo
+# los mensajes con más días que éstos
+MESSENGER_RETENTION_DAYS = 365
+
+# Límite de intentos de login y de restablecimiento de contraseña por IP y por usuario:
+# ráfagas de LOGIN_THROTTLE_BURST intentos y después LOGIN_THROTTLE_RATE por segundo.
+# Con LOGIN_THROTTLE_USE_CACHE los contadores se guardan en CACHES y no en cada proceso.
+# El cubo de cada usuario sólo gasta fichas con los intentos fallidos, así que limita
+# los ataques repartidos entre muchas IPs contra una cuenta; a cambio, quien falle a
+# propósito con el nombre de otro puede bloquearle el login durante
+# LOGIN_THROTTLE_BURST / LOGIN_THROTTLE_RATE segundos mientras siga intentándolo
+LOGIN_THROTTLE_RATE = 0.2
+LOGIN_THROTTLE_BURST = 10
+LOGIN_THROTTLE_USE_CACHE = False
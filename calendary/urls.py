@@ -30,8 +30,8 @@ urlpatterns = [
     path("empleados/", include(empleados_patterns)),
     path("admin/", admin.site.urls),
     # Paths de Auth
-    path("accounts/", include("django.contrib.auth.urls")),
     path("accounts/", include("registration.urls")),
+    path("accounts/", include("django.contrib.auth.urls")),
     path('profiles/', include(profiles_patterns)),
     path('messenger/', include(messenger_patterns)),
     path('eventos/', include(eventos_patterns)),
@@ -41,5 +41,6 @@ urlpatterns = [
 
 if settings.DEBUG:
     from django.conf.urls.static import static
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    from registration.views import serve_media
+    urlpatterns += static(settings.MEDIA_URL, view=serve_media, document_root=settings.MEDIA_ROOT)
   
@@ -19,7 +19,8 @@ document.addEventListener('DOMContentLoaded', function () {
             hour12: false
         },
 
-        events: '/eventos/api/eventos/',
+        // Cada calendario (global, de módulo o de lugar) indica su propio feed
+        events: calendarEl.dataset.eventsUrl || '/eventos/api/eventos/',
         displayEventTime: false,
         fixedWeekCount: true,
         dayMaxEvents: true,
@@ -1,3 +1,43 @@
-from django.test import TestCase
+import os
+import sqlite3
+import tempfile
+from django.db import connection, connections, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import SimpleTestCase
 
 # Create your tests here.
+class SQLiteSettingsTestCase(SimpleTestCase):
+    """
+    Comprueba los PRAGMA y el modo de transacción de settings.DATABASES sobre un fichero
+    nuevo (la base de datos de los tests está en memoria y no admite WAL).
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'db.sqlite3')
+        self.db = DatabaseWrapper({**connection.settings_dict, 'NAME': self.path}, alias='pragmas')
+        self.addCleanup(self.db.close)
+
+    def pragma(self, name):
+        with self.db.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_de_cada_conexion(self):
+        self.assertEqual(self.pragma('journal_mode'), 'wal')
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('temp_store'), 2)  # MEMORY
+
+    def test_transacciones_immediate(self):
+        connections['pragmas'] = self.db
+        self.addCleanup(delattr, connections._connections, 'pragmas')
+        other = sqlite3.connect(self.path, timeout=0, isolation_level=None)
+        self.addCleanup(other.close)
+        # Incluso una transacción que sólo lee tiene el bloqueo de escritura desde el BEGIN
+        with transaction.atomic(using='pragmas'):
+            self.pragma('user_version')
+            with self.assertRaisesMessage(sqlite3.OperationalError, 'locked'):
+                other.execute('BEGIN IMMEDIATE')
+        other.execute('BEGIN IMMEDIATE')
+        other.execute('ROLLBACK')
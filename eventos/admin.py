@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Evento, Lugar, Modulo
+from django.shortcuts import redirect
+from django.urls import reverse
+from django.utils.http import urlencode
+from .models import Evento, EventoArchivado, Lugar, Modulo
 
 # Register your models here.
 class ModuloAdmin(admin.ModelAdmin):
@@ -14,8 +17,21 @@ class LugarAdmin(admin.ModelAdmin):
 class EventoAdmin(admin.ModelAdmin):
     list_display = ('titulo',)
     autocomplete_fields = ['lugar', 'modulo']
+    actions = ['reprogramar']
+
+    @admin.action(description="Reprogramar eventos seleccionados")
+    def reprogramar(self, request, queryset):
+        # Enviamos los eventos seleccionados a la vista de reprogramación en bloque
+        ids = list(queryset.values_list('pk', flat=True))
+        return redirect(reverse('eventos:evento_reprogramar') + '?' + urlencode({'ids': ids}, doseq=True))
+
+class EventoArchivadoAdmin(admin.ModelAdmin):
+    list_display = ('titulo', 'fecha', 'archivado_el')
+    date_hierarchy = 'fecha'
+    autocomplete_fields = ['lugar', 'modulo']
 
 admin.site.register(Evento, EventoAdmin)
+admin.site.register(EventoArchivado, EventoArchivadoAdmin)
 admin.site.register(Lugar, LugarAdmin)
 admin.site.register(Modulo, ModuloAdmin)
 
@@ -0,0 +1,108 @@
+# eventos/cache.py
+import hashlib
+import time
+from django.core.cache import cache
+from django.utils.http import urlencode
+
+# Tiempo de vida (en segundos) de cada feed del calendario en la caché
+FEED_TIMEOUT = 60 * 60
+
+# Ámbitos posibles de un feed: el calendario global, el de un módulo o el de un lugar
+AMBITO_GLOBAL = 'global'
+AMBITO_MODULO = 'modulo'
+AMBITO_LUGAR = 'lugar'
+
+# Tiempo de vida (en segundos) de los contadores de facetas de la lista de eventos
+FACETAS_TIMEOUT = 60
+
+# Las agendas por sala y las facetas dependen de cualquier evento, así que se
+# versionan en bloque: cualquier cambio sube la versión y deja obsoletas las claves
+EVENTOS_VERSION_KEY = 'eventos:version'
+
+
+def feed_cache_key(ambito=AMBITO_GLOBAL, pk=None):
+    """
+    Devuelve la clave de caché del feed de un ámbito. Cada módulo y cada lugar
+    tienen su propia entrada para poder invalidarlas por separado.
+    """
+    if ambito == AMBITO_GLOBAL:
+        return 'eventos:feed:global'
+    return f'eventos:feed:{ambito}:{pk}'
+
+
+def get_or_build_feed(ambito, pk, builder):
+    """
+    Devuelve el feed cacheado del ámbito o lo construye con `builder` y lo guarda.
+    """
+    key = feed_cache_key(ambito, pk)
+    feed = cache.get(key)
+    if feed is None:
+        feed = builder()
+        cache.set(key, feed, FEED_TIMEOUT)
+    return feed
+
+
+def version_eventos():
+    """
+    Devuelve la versión actual de los datos de eventos.
+    """
+    return cache.get_or_set(EVENTOS_VERSION_KEY, 1, None)
+
+
+def agenda_cache_key(desde, hasta, agrupar):
+    """
+    Devuelve la clave de caché de la agenda de un rango de fechas. La clave incluye
+    la versión actual, de modo que al invalidar basta con cambiar la versión.
+    """
+    return f'eventos:agenda:{version_eventos()}:{agrupar}:{desde.isoformat()}:{hasta.isoformat()}'
+
+
+def get_or_build_agenda(desde, hasta, agrupar, builder):
+    """
+    Devuelve la agenda cacheada del rango o la construye con `builder` y la guarda.
+    """
+    key = agenda_cache_key(desde, hasta, agrupar)
+    agenda = cache.get(key)
+    if agenda is None:
+        agenda = builder()
+        cache.set(key, agenda, FEED_TIMEOUT)
+    return agenda
+
+
+def facetas_cache_key(filtros):
+    """
+    Devuelve la clave de caché de las facetas para una combinación de filtros.
+    """
+    firma = hashlib.md5(urlencode(sorted(filtros.items())).encode()).hexdigest()
+    return f'eventos:facetas:{version_eventos()}:{firma}'
+
+
+def get_or_build_facetas(filtros, builder):
+    """
+    Devuelve las facetas cacheadas para los filtros o las construye con `builder`.
+    Se guardan poco tiempo porque hay una entrada por cada combinación de filtros.
+    """
+    key = facetas_cache_key(filtros)
+    facetas = cache.get(key)
+    if facetas is None:
+        facetas = builder()
+        cache.set(key, facetas, FACETAS_TIMEOUT)
+    return facetas
+
+
+def invalidar_feeds(lugar_ids=(), modulo_ids=(), incluir_global=True):
+    """
+    Borra de la caché solo los feeds afectados por un cambio: el global (si procede),
+    los de los lugares indicados y los de los módulos indicados.
+    """
+    keys = [feed_cache_key(AMBITO_LUGAR, pk) for pk in set(lugar_ids) if pk is not None]
+    keys += [feed_cache_key(AMBITO_MODULO, pk) for pk in set(modulo_ids) if pk is not None]
+    if incluir_global:
+        keys.append(feed_cache_key(AMBITO_GLOBAL))
+    if keys:
+        cache.delete_many(keys)
+    # Cualquier cambio puede afectar a la agenda de algún día y a las facetas
+    try:
+        cache.incr(EVENTOS_VERSION_KEY)
+    except ValueError:
+        cache.set(EVENTOS_VERSION_KEY, time.time_ns(), None)
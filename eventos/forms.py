@@ -2,6 +2,10 @@ from django import forms
 from .models import Evento, Empleado, Lugar, Modulo
 from django_ckeditor_5.widgets import CKEditor5Widget
 from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import F
+from datetime import timedelta
+from .cache import invalidar_feeds
 
 class EventoForm(forms.ModelForm):
     """
@@ -197,3 +201,146 @@ class EventoUpdateForm(EventoForm):
         if self.instance and self.instance.modulo.exists():
             modulos_nombres = ", ".join([m.nombre for m in self.instance.modulo.all()])
             self.initial['modulo_nombres'] = modulos_nombres
+
+
+class ReprogramarEventosForm(forms.Form):
+    """
+    Formulario para mover de golpe un conjunto de eventos a otra fecha, horario o lugar.
+    Valida todos los huecos de destino con una sola consulta y guarda con bulk_update.
+    """
+    eventos = forms.ModelMultipleChoiceField(
+        queryset=Evento.objects.all(),
+        widget=forms.MultipleHiddenInput,
+        error_messages={'required': "Debe seleccionar al menos un evento."}
+    )
+    desplazar_dias = forms.IntegerField(
+        label="Desplazar (días)",
+        required=False,
+        widget=forms.NumberInput(attrs={'class': 'form-control'})
+    )
+    fecha = forms.DateField(
+        label="Nueva fecha",
+        required=False,
+        input_formats=['%Y-%m-%d', '%d/%m/%Y'],
+        widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control'}, format='%Y-%m-%d')
+    )
+    hora_inicio = forms.TimeField(
+        label="Nueva hora de inicio",
+        required=False,
+        widget=forms.TimeInput(attrs={'type': 'time', 'class': 'form-control'})
+    )
+    hora_fin = forms.TimeField(
+        label="Nueva hora de fin",
+        required=False,
+        widget=forms.TimeInput(attrs={'type': 'time', 'class': 'form-control'})
+    )
+    lugar_nombre = forms.CharField(
+        label="Nuevo lugar",
+        max_length=100,
+        required=False,
+        widget=forms.TextInput(attrs={'class': 'form-control autocomplete-field'})
+    )
+
+    def clean(self):
+        """
+        Calcula el destino de cada evento y comprueba que no se solapa con otros eventos
+        ni con el resto de eventos que se están moviendo.
+        """
+        cleaned_data = super().clean()
+        eventos = cleaned_data.get('eventos')
+        desplazar_dias = cleaned_data.get('desplazar_dias')
+        fecha = cleaned_data.get('fecha')
+        hora_inicio = cleaned_data.get('hora_inicio')
+        hora_fin = cleaned_data.get('hora_fin')
+        lugar_nombre = cleaned_data.get('lugar_nombre')
+
+        if desplazar_dias and fecha:
+            raise forms.ValidationError("Indique una nueva fecha o un desplazamiento en días, pero no ambos.")
+        if bool(hora_inicio) != bool(hora_fin):
+            raise forms.ValidationError("Debe indicar tanto la hora de inicio como la de fin.")
+        if hora_inicio and hora_fin and hora_inicio >= hora_fin:
+            self.add_error('hora_fin', "La hora de fin debe ser posterior a la hora de inicio.")
+
+        self.lugar_instance = None
+        if lugar_nombre:
+            try:
+                self.lugar_instance = Lugar.objects.get(nombre__iexact=lugar_nombre)
+            except ObjectDoesNotExist:
+                self.add_error('lugar_nombre', "El lugar no existe.")
+            except MultipleObjectsReturned:
+                self.add_error('lugar_nombre', "Existen múltiples lugares con este nombre. Por favor, sé más específico.")
+
+        if not (desplazar_dias or fecha or hora_inicio or lugar_nombre):
+            raise forms.ValidationError("No se ha indicado ningún cambio.")
+        if not eventos or self.errors:
+            return cleaned_data
+
+        # Destino de cada evento: (lugar, fecha, hora de inicio, hora de fin)
+        self.destinos = {}
+        for evento in eventos:
+            nueva_fecha = fecha or evento.fecha + timedelta(days=desplazar_dias or 0)
+            self.destinos[evento] = (
+                self.lugar_instance.pk if self.lugar_instance else evento.lugar_id,
+                nueva_fecha,
+                hora_inicio or evento.hora_inicio,
+                hora_fin or evento.hora_fin,
+            )
+
+        conflictos = self.buscar_conflictos(eventos)
+        if conflictos:
+            raise forms.ValidationError(conflictos)
+        return cleaned_data
+
+    def buscar_conflictos(self, eventos):
+        """
+        Carga con una única consulta los eventos que ocupan los lugares y días de destino
+        y devuelve la lista de solapamientos encontrados.
+        """
+        ocupados = {}
+        existentes = Evento.objects.filter(
+            lugar_id__in={destino[0] for destino in self.destinos.values()},
+            fecha__in={destino[1] for destino in self.destinos.values()},
+        ).exclude(
+            pk__in=[evento.pk for evento in eventos]
+        ).values_list('titulo', 'lugar_id', 'fecha', 'hora_inicio', 'hora_fin')
+        for titulo, lugar_id, fecha, hora_inicio, hora_fin in existentes:
+            ocupados.setdefault((lugar_id, fecha), []).append((hora_inicio, hora_fin, titulo))
+
+        conflictos = []
+        for evento, (lugar_id, fecha, hora_inicio, hora_fin) in self.destinos.items():
+            for otro_inicio, otro_fin, titulo in ocupados.get((lugar_id, fecha), []):
+                if hora_inicio < otro_fin and hora_fin > otro_inicio:
+                    conflictos.append(f"El evento '{evento.titulo}' se superpone con el evento '{titulo}' el {fecha:%d/%m/%Y}.")
+            # Los eventos ya comprobados también ocupan su nuevo hueco
+            ocupados.setdefault((lugar_id, fecha), []).append((hora_inicio, hora_fin, evento.titulo))
+        return conflictos
+
+    def save(self):
+        """
+        Aplica todos los cambios en una sola transacción con bulk_update e invalida
+        los feeds del calendario afectados (bulk_update no lanza señales). Dentro de la
+        transacción bloquea los lugares de destino y repite la comprobación de
+        conflictos, por si otra reprogramación se ha confirmado después de clean();
+        si los hay lanza ValidationError y no se guarda nada.
+        """
+        eventos = list(self.destinos)
+        lugar_ids = {evento.lugar_id for evento in eventos}
+        destino_ids = {destino[0] for destino in self.destinos.values()}
+
+        with transaction.atomic():
+            # Un UPDATE que no cambia nada toma el bloqueo antes de volver a leer: en SQLite
+            # el de escritura de toda la base de datos (sea cual sea SQLITE_TRANSACTION_MODE)
+            # y en el resto de bases de datos el de las filas de los lugares de destino
+            Lugar.objects.filter(pk__in=destino_ids).update(nombre=F('nombre'))
+            conflictos = self.buscar_conflictos(eventos)
+            if conflictos:
+                raise forms.ValidationError(conflictos)
+            for evento, (lugar_id, fecha, hora_inicio, hora_fin) in self.destinos.items():
+                evento.lugar_id, evento.fecha, evento.hora_inicio, evento.hora_fin = lugar_id, fecha, hora_inicio, hora_fin
+            lugar_ids |= destino_ids
+            Evento.objects.bulk_update(eventos, ['lugar', 'fecha', 'hora_inicio', 'hora_fin'])
+            modulo_ids = list(Evento.modulo.through.objects.filter(
+                evento_id__in=[evento.pk for evento in eventos]
+            ).values_list('modulo_id', flat=True))
+        invalidar_feeds(lugar_ids=lugar_ids, modulo_ids=modulo_ids)
+        return eventos
@@ -0,0 +1,76 @@
+# eventos/management/commands/archive_eventos.py
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from eventos.cache import FEED_TIMEOUT, invalidar_feeds
+from eventos.models import Evento, EventoArchivado
+
+# Campos que se copian tal cual del evento activo al archivado
+CAMPOS_ARCHIVO = [
+    'id', 'titulo', 'responsable_id', 'lugar_id', 'descripcion',
+    'fecha', 'hora_inicio', 'hora_fin', 'creador_id',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Mueve al archivo los eventos anteriores a una fecha, junto con sus módulos, por lotes. "
+        "Al terminar invalida una sola vez los feeds, agendas y facetas afectados en CACHES; "
+        "con una caché de cada proceso (LocMem) el servidor puede seguir mostrando los eventos "
+        f"archivados hasta {FEED_TIMEOUT // 60} minutos, así que conviene una caché compartida."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', required=True, help="Fecha límite (AAAA-MM-DD). Se archivan los eventos anteriores.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Número de eventos por lote.")
+
+    def handle(self, *args, **options):
+        try:
+            before = date.fromisoformat(options['before'])
+        except ValueError:
+            raise CommandError("La fecha debe tener el formato AAAA-MM-DD.")
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("El tamaño de lote debe ser mayor que cero.")
+
+        total = 0
+        self.lugar_ids, self.modulo_ids = set(), set()
+        while True:
+            archivados = self.archivar_lote(before, batch_size)
+            if not archivados:
+                break
+            total += archivados
+            self.stdout.write(f"{total} eventos archivados...")
+        if total:
+            invalidar_feeds(lugar_ids=self.lugar_ids, modulo_ids=self.modulo_ids)
+
+        self.stdout.write(self.style.SUCCESS(f"Archivados {total} eventos anteriores a {before.isoformat()}."))
+
+    def archivar_lote(self, before, batch_size):
+        """
+        Copia un lote de eventos y sus módulos al archivo y los borra de la tabla activa,
+        todo dentro de una única transacción y con un número fijo de consultas. Los borrados
+        no lanzan señales (costarían consultas por evento); los feeds afectados se anotan
+        para invalidarlos al final.
+        """
+        with transaction.atomic():
+            filas = list(
+                Evento.objects.filter(fecha__lt=before).order_by('pk').values(*CAMPOS_ARCHIVO)[:batch_size]
+            )
+            if not filas:
+                return 0
+            pks = [fila['id'] for fila in filas]
+
+            EventoArchivado.objects.bulk_create([EventoArchivado(**fila) for fila in filas])
+            enlaces = list(Evento.modulo.through.objects.filter(evento_id__in=pks).values_list('evento_id', 'modulo_id'))
+            EventoArchivado.modulo.through.objects.bulk_create([
+                EventoArchivado.modulo.through(eventoarchivado_id=evento_id, modulo_id=modulo_id)
+                for evento_id, modulo_id in enlaces
+            ])
+
+            # Evento no tiene más relaciones que la de módulos, así que basta con dos DELETE
+            Evento.modulo.through.objects.filter(evento_id__in=pks)._raw_delete(Evento.objects.db)
+            Evento.objects.filter(pk__in=pks)._raw_delete(Evento.objects.db)
+        self.lugar_ids.update(fila['lugar_id'] for fila in filas)
+        self.modulo_ids.update(modulo_id for _, modulo_id in enlaces)
+        return len(pks)
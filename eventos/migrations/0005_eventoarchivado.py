@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('empleados', '0003_alter_empleado_options'),
+        ('eventos', '0004_evento_creador'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoArchivado',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('titulo', models.CharField(max_length=255)),
+                ('descripcion', models.TextField(blank=True)),
+                ('fecha', models.DateField()),
+                ('hora_inicio', models.TimeField()),
+                ('hora_fin', models.TimeField()),
+                ('archivado_el', models.DateTimeField(auto_now_add=True)),
+                ('creador', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='eventos_archivados', to=settings.AUTH_USER_MODEL)),
+                ('lugar', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='eventos_archivados_lugar', to='eventos.lugar')),
+                ('modulo', models.ManyToManyField(related_name='eventos_archivados_modulo', to='eventos.modulo')),
+                ('responsable', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='eventos_archivados_responsable', to='empleados.empleado')),
+            ],
+            options={
+                'verbose_name': 'Evento archivado',
+                'verbose_name_plural': 'Eventos archivados',
+                'ordering': ['fecha', 'hora_inicio'],
+            },
+        ),
+    ]
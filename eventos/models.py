@@ -1,8 +1,12 @@
 from django.db import models
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from datetime import timedelta
 from empleados.models import Empleado
+from .cache import AMBITO_MODULO, AMBITO_LUGAR, invalidar_feeds
 
 # Obtenemos el modelo de usuario personalizado que has definido
 User = get_user_model()
@@ -25,6 +29,23 @@ class Modulo(models.Model):
     def __str__(self):
         return self.nombre
 
+class EventoQuerySet(models.QuerySet):
+    def por_ambito(self, ambito=None, pk=None):
+        """
+        Filtra los eventos de un módulo o de un lugar. Sin ámbito devuelve todos.
+        """
+        if ambito == AMBITO_MODULO:
+            # Usamos EXISTS sobre la tabla intermedia en lugar de un JOIN para que
+            # la relación muchos a muchos nunca devuelva filas duplicadas
+            modulos = self.model.modulo.through.objects.filter(
+                evento_id=OuterRef('pk'), modulo_id=pk
+            )
+            return self.filter(Exists(modulos))
+        if ambito == AMBITO_LUGAR:
+            return self.filter(lugar_id=pk)
+        return self
+
+
 class Evento(models.Model):
     """
     Modelo para gestionar los eventos.
@@ -56,6 +77,11 @@ class Evento(models.Model):
         related_name='eventos_creados'
     )
     
+    objects = EventoQuerySet.as_manager()
+
+    # Los eventos de esta tabla están activos; los antiguos viven en EventoArchivado
+    archivado = False
+
     class Meta:
         ordering = ['fecha', 'hora_inicio']
         verbose_name = 'Evento'
@@ -64,3 +90,91 @@ class Evento(models.Model):
     def __str__(self):
         return f'{self.titulo} - {self.fecha}'
 
+class EventoArchivado(models.Model):
+    """
+    Modelo para los eventos pasados que se sacan de la tabla de eventos activos.
+    Conserva el id original para que las URLs de detalle sigan funcionando.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    titulo = models.CharField(max_length=255)
+    responsable = models.ForeignKey(Empleado, on_delete=models.PROTECT, related_name='eventos_archivados_responsable')
+    lugar = models.ForeignKey(Lugar, on_delete=models.PROTECT, related_name='eventos_archivados_lugar')
+    modulo = models.ManyToManyField(Modulo, related_name='eventos_archivados_modulo')
+    descripcion = models.TextField(blank=True)
+    fecha = models.DateField()
+    hora_inicio = models.TimeField()
+    hora_fin = models.TimeField()
+    creador = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='eventos_archivados'
+    )
+    # Momento en que el evento se movió al archivo
+    archivado_el = models.DateTimeField(auto_now_add=True)
+
+    archivado = True
+
+    class Meta:
+        ordering = ['fecha', 'hora_inicio']
+        verbose_name = 'Evento archivado'
+        verbose_name_plural = 'Eventos archivados'
+
+    def __str__(self):
+        return f'{self.titulo} - {self.fecha}'
+
+
+# Señales para invalidar solo los feeds del calendario afectados por cada cambio
+
+@receiver(pre_save, sender=Evento)
+def recordar_lugar_anterior(sender, instance, **kwargs):
+    # Si el evento cambia de lugar también hay que invalidar el feed del lugar antiguo
+    instance._lugar_anterior_id = None
+    if instance.pk:
+        instance._lugar_anterior_id = sender.objects.filter(pk=instance.pk).values_list('lugar_id', flat=True).first()
+
+
+@receiver(post_save, sender=Evento)
+def evento_guardado(sender, instance, created, **kwargs):
+    modulo_ids = [] if created else list(instance.modulo.values_list('pk', flat=True))
+    invalidar_feeds(
+        lugar_ids=[instance.lugar_id, getattr(instance, '_lugar_anterior_id', None)],
+        modulo_ids=modulo_ids,
+    )
+
+
+@receiver(pre_delete, sender=Evento)
+def recordar_modulos_evento(sender, instance, **kwargs):
+    # Las filas de la tabla intermedia se borran antes que el evento, así que las guardamos ahora
+    instance._modulo_ids = list(instance.modulo.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Evento)
+def evento_borrado(sender, instance, **kwargs):
+    invalidar_feeds(lugar_ids=[instance.lugar_id], modulo_ids=getattr(instance, '_modulo_ids', []))
+
+
+@receiver(post_delete, sender=Lugar)
+def lugar_borrado(sender, instance, **kwargs):
+    # El feed del lugar cacheado seguiría respondiendo 200 en vez de 404 hasta caducar
+    invalidar_feeds(lugar_ids=[instance.pk], incluir_global=False)
+
+
+@receiver(post_delete, sender=Modulo)
+def modulo_borrado(sender, instance, **kwargs):
+    invalidar_feeds(modulo_ids=[instance.pk], incluir_global=False)
+
+
+@receiver(m2m_changed, sender=Evento.modulo.through)
+def modulos_evento_cambiados(sender, instance, action, reverse, pk_set, **kwargs):
+    # Los módulos no aparecen en el feed global ni en el de los lugares,
+    # así que solo invalidamos los feeds de los módulos afectados
+    if action == 'pre_clear':
+        if reverse:
+            instance._modulo_ids = [instance.pk]
+        else:
+            instance._modulo_ids = list(instance.modulo.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        invalidar_feeds(modulo_ids=getattr(instance, '_modulo_ids', []), incluir_global=False)
+    elif action in ('post_add', 'post_remove'):
+        modulo_ids = [instance.pk] if reverse else (pk_set or [])
+        invalidar_feeds(modulo_ids=modulo_ids, incluir_global=False)
@@ -1,11 +1,20 @@
 # eventos/tests.py
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from io import StringIO
 from datetime import date, time, timedelta
-from .models import Evento, Lugar, Modulo
+from .models import Evento, EventoArchivado, Lugar, Modulo
 from empleados.models import Empleado, Departamento
-from .forms import EventoForm, EventoUpdateForm
+from .forms import EventoForm, EventoUpdateForm, ReprogramarEventosForm
+from .cache import AMBITO_GLOBAL, AMBITO_MODULO, AMBITO_LUGAR, feed_cache_key, invalidar_feeds
+from .management.commands.archive_eventos import Command as ArchiveEventosCommand
+from unittest.mock import patch
 
 User = get_user_model()
 
@@ -59,6 +68,7 @@ class EventoTestCase(TestCase):
 
     def setUp(self):
         self.client = Client()
+        cache.clear()
 
     # ------------------
     # Tests de modelos
@@ -240,4 +250,295 @@ class EventoTestCase(TestCase):
             }]
         )
 
+    # ------------------
+    # Tests de calendarios por módulo y lugar
+    # ------------------
+    def test_api_modulo_sin_duplicados(self):
+        otro_lugar = Lugar.objects.create(nombre="Sala 2")
+        evento2 = Evento.objects.create(
+            titulo="Solo Modulo B", fecha=date.today(), hora_inicio=time(8, 0), hora_fin=time(9, 0),
+            responsable=self.empleado, lugar=otro_lugar, creador=self.staff_user
+        )
+        evento2.modulo.set([self.modulo2])
+
+        response = self.client.get(reverse('eventos:lista_eventos_api_modulo', args=[self.modulo1.pk]))
+        self.assertEqual([e['title'] for e in response.json()], ["Evento Test"])
+
+        # El evento con dos módulos aparece una sola vez en el feed del módulo B
+        response = self.client.get(reverse('eventos:lista_eventos_api_modulo', args=[self.modulo2.pk]))
+        self.assertEqual([e['title'] for e in response.json()], ["Solo Modulo B", "Evento Test"])
+
+        response = self.client.get(reverse('eventos:lista_eventos_api_lugar', args=[otro_lugar.pk]))
+        self.assertEqual([e['title'] for e in response.json()], ["Solo Modulo B"])
+
+    def test_api_ambito_inexistente(self):
+        response = self.client.get(reverse('eventos:lista_eventos_api_modulo', args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_api_ambito_borrado_no_sirve_la_cache(self):
+        modulo3 = Modulo.objects.create(nombre="Modulo C")
+        lugar2 = Lugar.objects.create(nombre="Sala vacía")
+        urls = [reverse('eventos:lista_eventos_api_modulo', args=[modulo3.pk]),
+                reverse('eventos:lista_eventos_api_lugar', args=[lugar2.pk])]
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        modulo3.delete()
+        lugar2.delete()
+        for url in urls:
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_calendario_ambito_view(self):
+        response = self.client.get(reverse('eventos:calendario_modulo', args=[self.modulo1.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, reverse('eventos:lista_eventos_api_modulo', args=[self.modulo1.pk]))
+
+    def test_feeds_se_invalidan_por_ambito(self):
+        modulo3 = Modulo.objects.create(nombre="Modulo C")
+        for ambito, pk in [(AMBITO_GLOBAL, None), (AMBITO_MODULO, self.modulo1.pk), (AMBITO_MODULO, modulo3.pk)]:
+            cache.set(feed_cache_key(ambito, pk), [])
+
+        # Quitar un módulo solo invalida la caché de ese módulo
+        self.evento.modulo.remove(self.modulo1)
+        self.assertIsNone(cache.get(feed_cache_key(AMBITO_MODULO, self.modulo1.pk)))
+        self.assertIsNotNone(cache.get(feed_cache_key(AMBITO_GLOBAL)))
+        self.assertIsNotNone(cache.get(feed_cache_key(AMBITO_MODULO, modulo3.pk)))
+
+        # Editar el evento invalida el feed global, el de su lugar y el de sus módulos, no el resto
+        cache.set(feed_cache_key(AMBITO_MODULO, self.modulo2.pk), [])
+        cache.set(feed_cache_key(AMBITO_LUGAR, self.lugar.pk), [])
+        self.evento.titulo = "Evento Editado"
+        self.evento.save()
+        self.assertIsNone(cache.get(feed_cache_key(AMBITO_GLOBAL)))
+        self.assertIsNone(cache.get(feed_cache_key(AMBITO_LUGAR, self.lugar.pk)))
+        self.assertIsNone(cache.get(feed_cache_key(AMBITO_MODULO, self.modulo2.pk)))
+        self.assertIsNotNone(cache.get(feed_cache_key(AMBITO_MODULO, modulo3.pk)))
+
+    # ------------------
+    # Tests de la agenda por salas
+    # ------------------
+    def test_agenda_api_agrupa_por_lugar(self):
+        otro_lugar = Lugar.objects.create(nombre="Aula 0")
+        for hora in (8, 12):
+            evento = Evento.objects.create(
+                titulo=f"Aula {hora}", fecha=date.today(), hora_inicio=time(hora, 0), hora_fin=time(hora + 1, 0),
+                responsable=self.empleado, lugar=otro_lugar, creador=self.staff_user
+            )
+            evento.modulo.set([self.modulo1])
+
+        # Una única consulta para todas las salas
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('eventos:agenda_api'), {'fecha': date.today().isoformat()})
+        grupos = response.json()['grupos']
+        self.assertEqual([g['nombre'] for g in grupos], ["Aula 0", "Sala 1"])
+        self.assertEqual([e['title'] for e in grupos[0]['eventos']], ["Aula 8", "Aula 12"])
+
+        # La segunda petición se sirve desde la caché
+        with self.assertNumQueries(0):
+            self.client.get(reverse('eventos:agenda_api'), {'fecha': date.today().isoformat()})
+
+    def test_agenda_api_agrupa_por_modulo(self):
+        response = self.client.get(reverse('eventos:agenda_api'), {'agrupar': 'modulo'})
+        grupos = response.json()['grupos']
+        self.assertEqual([g['nombre'] for g in grupos], ["Modulo A", "Modulo B"])
+        self.assertEqual([e['title'] for e in grupos[1]['eventos']], ["Evento Test"])
+
+    def test_agenda_api_se_invalida(self):
+        self.client.get(reverse('eventos:agenda_api'))
+        self.evento.titulo = "Evento Renombrado"
+        self.evento.save()
+        response = self.client.get(reverse('eventos:agenda_api'))
+        self.assertEqual(response.json()['grupos'][0]['eventos'][0]['title'], "Evento Renombrado")
+
+    def test_agenda_api_rango_invalido(self):
+        response = self.client.get(reverse('eventos:agenda_api'), {'desde': '2025-01-10', 'hasta': '2025-01-01'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('eventos:agenda_api'), {'fecha': 'ayer'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_agenda_view(self):
+        response = self.client.get(reverse('eventos:agenda'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'eventos/agenda.html')
+        self.assertContains(response, self.evento.titulo)
+
+    def test_agenda_view_rango_invalido(self):
+        response = self.client.get(reverse('eventos:agenda'), {'desde': '2025-01-01', 'hasta': '2025-03-01'})
+        self.assertEqual(response.status_code, 400)
+
+    # ------------------
+    # Tests del archivo de eventos
+    # ------------------
+    def crear_evento_pasado(self, titulo, dias):
+        evento = Evento.objects.create(
+            titulo=titulo, fecha=date.today() - timedelta(days=dias), hora_inicio=time(9, 0), hora_fin=time(10, 0),
+            responsable=self.empleado, lugar=self.lugar, creador=self.staff_user
+        )
+        evento.modulo.set([self.modulo1])
+        return evento
+
+    def test_archive_eventos_command(self):
+        antiguos = [self.crear_evento_pasado(f"Antiguo {i}", 400 + i) for i in range(3)]
+        call_command('archive_eventos', '--before', (date.today() - timedelta(days=365)).isoformat(),
+                     '--batch-size', '2', stdout=StringIO())
+
+        self.assertFalse(Evento.objects.filter(pk__in=[e.pk for e in antiguos]).exists())
+        self.assertTrue(Evento.objects.filter(pk=self.evento.pk).exists())
+        archivado = EventoArchivado.objects.get(pk=antiguos[0].pk)
+        self.assertEqual(archivado.titulo, "Antiguo 0")
+        self.assertEqual(list(archivado.modulo.all()), [self.modulo1])
+
+    def test_archive_eventos_consultas_por_lote_constantes(self):
+        for i in range(5):
+            self.crear_evento_pasado(f"Antiguo {i}", 400 + i)
+        before = date.today() - timedelta(days=365)
+        command = ArchiveEventosCommand()
+        command.lugar_ids, command.modulo_ids = set(), set()
+        with CaptureQueriesContext(connection) as uno:
+            command.archivar_lote(before, 1)
+        with CaptureQueriesContext(connection) as cuatro:
+            command.archivar_lote(before, 4)
+        self.assertEqual(len(uno), len(cuatro))
+
+    def test_archive_eventos_invalida_los_feeds_una_vez(self):
+        self.crear_evento_pasado("Antiguo", 400)
+        claves = [feed_cache_key(), feed_cache_key(AMBITO_LUGAR, self.lugar.pk),
+                  feed_cache_key(AMBITO_MODULO, self.modulo1.pk)]
+        for clave in claves:
+            cache.set(clave, [])
+        with patch('eventos.management.commands.archive_eventos.invalidar_feeds',
+                   wraps=invalidar_feeds) as invalidar:
+            call_command('archive_eventos', '--before', date.today().isoformat(),
+                         '--batch-size', '1', stdout=StringIO())
+        self.assertEqual(invalidar.call_count, 1)
+        self.assertEqual(cache.get_many(claves), {})
+
+    def test_detail_view_evento_archivado(self):
+        antiguo = self.crear_evento_pasado("Antiguo", 400)
+        call_command('archive_eventos', '--before', date.today().isoformat(), stdout=StringIO())
+
+        response = self.client.get(reverse('eventos:evento_detail', args=[antiguo.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Antiguo")
+        self.assertContains(response, "(archivado)")
+
+    def test_list_view_incluir_archivo(self):
+        self.crear_evento_pasado("Antiguo", 400)
+        call_command('archive_eventos', '--before', date.today().isoformat(), stdout=StringIO())
+
+        response = self.client.get(reverse('eventos:evento_list'))
+        self.assertNotContains(response, "Antiguo")
+
+        response = self.client.get(reverse('eventos:evento_list'), {'archivo': '1', 'lugar': 'Sala'})
+        titulos = [evento.titulo for evento in response.context['evento_list']]
+        self.assertEqual(titulos, ["Antiguo", "Evento Test"])
+
+    # ------------------
+    # Tests de la reprogramación en bloque
+    # ------------------
+    def test_reprogramar_form_desplaza_eventos(self):
+        otro = Evento.objects.create(
+            titulo="Otro", fecha=date.today(), hora_inicio=time(13, 0), hora_fin=time(14, 0),
+            responsable=self.empleado, lugar=self.lugar, creador=self.staff_user
+        )
+        sala2 = Lugar.objects.create(nombre="Sala 2")
+        form = ReprogramarEventosForm(data={
+            'eventos': [self.evento.pk, otro.pk], 'desplazar_dias': 1, 'lugar_nombre': "Sala 2"
+        })
+        with self.assertNumQueries(3):
+            # Eventos seleccionados, lugar de destino y una única consulta de conflictos
+            self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+
+        self.evento.refresh_from_db()
+        otro.refresh_from_db()
+        self.assertEqual(self.evento.fecha, date.today() + timedelta(days=1))
+        self.assertEqual(otro.lugar, sala2)
+
+    def test_reprogramar_form_detecta_conflictos(self):
+        Evento.objects.create(
+            titulo="Ocupado", fecha=date.today() + timedelta(days=1), hora_inicio=time(11, 0), hora_fin=time(13, 0),
+            responsable=self.empleado, lugar=self.lugar, creador=self.staff_user
+        )
+        form = ReprogramarEventosForm(data={'eventos': [self.evento.pk], 'desplazar_dias': 1})
+        self.assertFalse(form.is_valid())
+        self.assertIn('__all__', form.errors)
+
+    def test_reprogramar_form_conflicto_entre_seleccionados(self):
+        otro = Evento.objects.create(
+            titulo="Otro", fecha=date.today() + timedelta(days=3), hora_inicio=time(10, 30), hora_fin=time(11, 30),
+            responsable=self.empleado, lugar=self.lugar, creador=self.staff_user
+        )
+        form = ReprogramarEventosForm(data={
+            'eventos': [self.evento.pk, otro.pk], 'fecha': (date.today() + timedelta(days=5)).isoformat()
+        })
+        self.assertFalse(form.is_valid())
+
+    def test_reprogramar_save_revalida_dentro_de_la_transaccion(self):
+        form = ReprogramarEventosForm(data={'eventos': [self.evento.pk], 'desplazar_dias': 1})
+        self.assertTrue(form.is_valid(), form.errors)
+        # Otra reprogramación ocupa el hueco entre la validación y el guardado
+        Evento.objects.create(
+            titulo="Ocupado", fecha=date.today() + timedelta(days=1), hora_inicio=time(11, 0), hora_fin=time(13, 0),
+            responsable=self.empleado, lugar=self.lugar, creador=self.staff_user
+        )
+        with CaptureQueriesContext(connection) as queries, self.assertRaises(ValidationError):
+            form.save()
+        self.evento.refresh_from_db()
+        self.assertEqual(self.evento.fecha, date.today())
+        # El bloqueo se toma con un UPDATE antes de volver a buscar conflictos
+        sentencias = [q['sql'] for q in queries if not q['sql'].startswith(('BEGIN', 'SAVEPOINT'))]
+        self.assertTrue(sentencias[0].startswith('UPDATE "eventos_lugar"'), sentencias[0])
+
+    def test_reprogramar_view_requires_staff(self):
+        self.client.login(username='user', password='userpass')
+        response = self.client.get(reverse('eventos:evento_reprogramar'), {'ids': [self.evento.pk]})
+        self.assertEqual(response.status_code, 302)
+
+        self.client.login(username='admin', password='adminpass')
+        response = self.client.get(reverse('eventos:evento_reprogramar'), {'ids': [self.evento.pk]})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, self.evento.titulo)
+
+        response = self.client.post(reverse('eventos:evento_reprogramar'), {
+            'eventos': [self.evento.pk], 'hora_inicio': "16:00", 'hora_fin': "17:00"
+        })
+        self.assertRedirects(response, reverse('eventos:evento_list') + '?ok')
+        self.evento.refresh_from_db()
+        self.assertEqual(self.evento.hora_inicio, time(16, 0))
+
+    # ------------------
+    # Tests de las facetas de la lista
+    # ------------------
+    def test_list_view_facetas(self):
+        sala2 = Lugar.objects.create(nombre="Sala 2")
+        for hora in (8, 14):
+            evento = Evento.objects.create(
+                titulo=f"Sala 2 - {hora}", fecha=date.today(), hora_inicio=time(hora, 0), hora_fin=time(hora + 1, 0),
+                responsable=self.empleado, lugar=sala2, creador=self.staff_user
+            )
+            evento.modulo.set([self.modulo1])
+
+        response = self.client.get(reverse('eventos:evento_list'))
+        facetas = {f['campo']: {v['nombre']: v['total'] for v in f['valores']} for f in response.context['facetas']}
+        self.assertEqual(facetas['lugar'], {"Sala 2": 2, "Sala 1": 1})
+        self.assertEqual(facetas['modulo'], {"Modulo A": 3, "Modulo B": 1})
+        self.assertEqual(facetas['responsable'], {"Juan Pérez": 3})
+
+        # Al pulsar una faceta se refina la lista por su id
+        response = self.client.get(reverse('eventos:evento_list'), {'lugar_id': sala2.pk})
+        self.assertEqual(len(response.context['evento_list']), 2)
+        facetas = {f['campo']: f['valores'] for f in response.context['facetas']}
+        self.assertTrue(facetas['lugar'][0]['activo'])
+        self.assertEqual({v['nombre']: v['total'] for v in facetas['modulo']}, {"Modulo A": 2})
 
+    def test_facetas_consultas_acotadas(self):
+        for i in range(20):
+            Lugar.objects.create(nombre=f"Aula {i}")
+        # Tres consultas agrupadas, una por faceta; la segunda vez salen de la caché
+        from .views import contar_facetas
+        with self.assertNumQueries(3):
+            contar_facetas(Evento.objects.all())
+        self.client.get(reverse('eventos:evento_list'))
+        with self.assertNumQueries(3):
+            # count + página + prefetch de módulos, sin facetas
+            self.client.get(reverse('eventos:evento_list'))
@@ -1,8 +1,10 @@
 from django.urls import path
 from .views import (
     EventoListView, EventoDetailView, EventoCreate, 
-    EventoUpdate, EventoDelete, EventoApiView, CalendarioView
+    EventoUpdate, EventoDelete, EventoApiView, CalendarioView,
+    AgendaApiView, AgendaView, EventoReprogramar
 )
+from .cache import AMBITO_MODULO, AMBITO_LUGAR
 
 
 eventos_patterns = ([
@@ -16,10 +18,22 @@ eventos_patterns = ([
     path('<int:pk>/editar/', EventoUpdate.as_view(), name='evento_update'),
     # Elimina un evento
     path('<int:pk>/eliminar/', EventoDelete.as_view(), name='evento_delete'),
+    # Reprograma varios eventos a la vez (solo personal)
+    path('reprogramar/', EventoReprogramar.as_view(), name='evento_reprogramar'),
  # API para obtener la lista de eventos en formato JSON
     path('api/eventos/', EventoApiView.as_view(), name='lista_eventos_api'),
+    # Feeds de eventos de un módulo o de un lugar concreto
+    path('api/eventos/modulo/<int:pk>/', EventoApiView.as_view(ambito=AMBITO_MODULO), name='lista_eventos_api_modulo'),
+    path('api/eventos/lugar/<int:pk>/', EventoApiView.as_view(ambito=AMBITO_LUGAR), name='lista_eventos_api_lugar'),
     
     # Vista para renderizar el calendario
     path('calendario/', CalendarioView.as_view(), name='calendario'),
+    # Calendarios de un módulo o de un lugar concreto
+    path('calendario/modulo/<int:pk>/', CalendarioView.as_view(ambito=AMBITO_MODULO), name='calendario_modulo'),
+    path('calendario/lugar/<int:pk>/', CalendarioView.as_view(ambito=AMBITO_LUGAR), name='calendario_lugar'),
+
+    # Agenda del día agrupada por salas (o por módulos)
+    path('api/agenda/', AgendaApiView.as_view(), name='agenda_api'),
+    path('agenda/', AgendaView.as_view(), name='agenda'),
     
 ], 'eventos')
\ No newline at end of file
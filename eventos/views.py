@@ -1,15 +1,23 @@
 from django.urls import reverse_lazy, reverse
-from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
+from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView, FormView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from .models import Evento, Lugar 
+from .models import Evento, EventoArchivado, Lugar, Modulo
+from .cache import (
+    AMBITO_GLOBAL, AMBITO_MODULO, AMBITO_LUGAR,
+    get_or_build_feed, get_or_build_agenda, get_or_build_facetas
+)
+from datetime import date, timedelta
+from itertools import groupby
 from django.contrib.admin.views.decorators import staff_member_required
+from django.utils import timezone
 from django.utils.decorators import method_decorator
-from .forms import EventoForm, EventoUpdateForm
+from .forms import EventoForm, EventoUpdateForm, ReprogramarEventosForm
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import JsonResponse
+from django.http import HttpResponseBadRequest, JsonResponse, Http404
+from django.core.exceptions import ValidationError
 from django.views import View
 from django.contrib.auth.mixins import AccessMixin
-from django.db.models import Q
+from django.db.models import Q, Value, BooleanField, Count
 
 # Create your views here.
 
@@ -31,6 +39,77 @@ class OwnerOrSuperuserRequiredMixin(AccessMixin):
             
         return super().dispatch(request, *args, **kwargs)
 
+# Facetas de la lista de eventos y número máximo de valores que se muestran de cada una
+FACETAS = {'lugar': 'Lugar', 'modulo': 'Módulo', 'responsable': 'Responsable'}
+FACETAS_LIMITE = 10
+
+# Parámetros GET que determinan el conjunto filtrado (y por tanto las facetas)
+PARAMETROS_FILTRO = ('responsable', 'lugar', 'modulo') + tuple(f'{campo}_id' for campo in FACETAS)
+
+def filtrar_eventos(queryset, params):
+    """
+    Aplica los filtros de búsqueda de la lista. Sirve tanto para los eventos activos
+    como para los archivados, porque ambos modelos tienen los mismos campos.
+    """
+    # 1. Inicializamos un diccionario vacío para los filtros
+    filtros = {}
+
+    # 2. Verificamos cada posible parámetro de la URL
+    responsable_query = params.get('responsable', '')
+    lugar_query = params.get('lugar', '')
+    modulo_query = params.get('modulo', '')
+
+    # 3. Construimos los filtros solo si tienen un valor
+    if responsable_query:
+        # Usamos Q para el filtro OR en nombre y apellido
+        queryset = queryset.filter(
+            Q(responsable__nombre__icontains=responsable_query) |
+            Q(responsable__apellidos__icontains=responsable_query)
+        )
+
+    if lugar_query:
+        # Filtro por nombre de lugar
+        filtros['lugar__nombre__icontains'] = lugar_query
+
+    if modulo_query:
+        # Filtro por nombre de módulo (Many-to-Many)
+        filtros['modulo__nombre__icontains'] = modulo_query
+
+    # 4. Refinamientos exactos que se aplican al pulsar una faceta
+    for campo in FACETAS:
+        valor = params.get(f'{campo}_id', '')
+        if valor.isdigit():
+            filtros[f'{campo}__id'] = int(valor)
+        
+    # 5. Aplicamos los filtros restantes (si los hay)
+    return queryset.filter(**filtros)
+
+def contar_facetas(queryset):
+    """
+    Cuenta los eventos filtrados por lugar, módulo y responsable con una consulta
+    agrupada por faceta (tres en total), sin importar cuántos valores tenga cada una.
+    """
+    pks = queryset.values('pk')
+    lugares = queryset.order_by().values_list('lugar_id', 'lugar__nombre').annotate(
+        total=Count('pk', distinct=True)
+    ).order_by('-total', 'lugar__nombre')[:FACETAS_LIMITE]
+    modulos = Evento.modulo.through.objects.filter(evento_id__in=pks).values_list(
+        'modulo_id', 'modulo__nombre'
+    ).annotate(
+        total=Count('evento_id', distinct=True)
+    ).order_by('-total', 'modulo__nombre')[:FACETAS_LIMITE]
+    responsables = queryset.order_by().values_list(
+        'responsable_id', 'responsable__nombre', 'responsable__apellidos'
+    ).annotate(
+        total=Count('pk', distinct=True)
+    ).order_by('-total', 'responsable__nombre')[:FACETAS_LIMITE]
+
+    return {
+        'lugar': [(pk, nombre, total) for pk, nombre, total in lugares],
+        'modulo': [(pk, nombre, total) for pk, nombre, total in modulos],
+        'responsable': [(pk, f'{nombre} {apellidos}', total) for pk, nombre, apellidos, total in responsables],
+    }
+
 class EventoListView(ListView):
     """
     Vista para mostrar una lista de todos los eventos.
@@ -38,38 +117,45 @@ class EventoListView(ListView):
     model = Evento
     paginate_by = 10 # Número de eventos por página
 
+    def incluir_archivo(self):
+        # El archivo solo se consulta si el usuario lo pide expresamente
+        return bool(self.request.GET.get('archivo'))
+
     def get_queryset(self):
-        # 1. Obtenemos el conjunto de datos inicial
-        queryset = super().get_queryset()
-
-        # 2. Inicializamos un diccionario vacío para los filtros
-        filtros = {}
-
-        # 3. Verificamos cada posible parámetro de la URL
-        responsable_query = self.request.GET.get('responsable', '')
-        lugar_query = self.request.GET.get('lugar', '')
-        modulo_query = self.request.GET.get('modulo', '')
-
-        # 4. Construimos los filtros solo si tienen un valor
-        if responsable_query:
-            # Usamos Q para el filtro OR en nombre y apellido
-            queryset = queryset.filter(
-                Q(responsable__nombre__icontains=responsable_query) |
-                Q(responsable__apellidos__icontains=responsable_query)
-            )
+        queryset = filtrar_eventos(super().get_queryset(), self.request.GET)
+        if not self.incluir_archivo():
+            # La tabla muestra responsable, lugar y módulos de cada evento
+            return queryset.select_related('responsable', 'lugar').prefetch_related('modulo')
 
-        if lugar_query:
-            # Filtro por nombre de lugar
-            filtros['lugar__nombre__icontains'] = lugar_query
+        # Con el archivo paginamos una UNION de (id, fecha, hora, archivado) de ambas
+        # tablas y solo cargamos los objetos de la página que se va a mostrar
+        campos = ('pk', 'fecha', 'hora_inicio', 'es_archivado')
+        activos = queryset.annotate(es_archivado=Value(False, output_field=BooleanField())).values_list(*campos)
+        archivados = filtrar_eventos(EventoArchivado.objects.all(), self.request.GET).annotate(
+            es_archivado=Value(True, output_field=BooleanField())
+        ).values_list(*campos)
+        return activos.order_by().union(archivados.order_by()).order_by('fecha', 'hora_inicio')
 
-        if modulo_query:
-            # Filtro por nombre de módulo (Many-to-Many)
-            filtros['modulo__nombre__icontains'] = modulo_query
-            
-        # 5. Aplicamos los filtros restantes (si los hay)
-        queryset = queryset.filter(**filtros)
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, object_list, is_paginated = super().paginate_queryset(queryset, page_size)
+        if self.incluir_archivo():
+            object_list = self.cargar_pagina(page.object_list)
+            page.object_list = object_list
+        return paginator, page, object_list, is_paginated
 
-        return queryset
+    def cargar_pagina(self, filas):
+        """
+        Convierte las filas (pk, fecha, hora, archivado) de la página en objetos,
+        con una consulta por tabla, manteniendo el orden de la paginación.
+        """
+        filas = list(filas)
+        objetos = {}
+        for modelo, es_archivado in ((Evento, False), (EventoArchivado, True)):
+            pks = [fila[0] for fila in filas if bool(fila[3]) == es_archivado]
+            if pks:
+                encontrados = modelo.objects.filter(pk__in=pks).select_related('responsable', 'lugar').prefetch_related('modulo')
+                objetos.update({(es_archivado, obj.pk): obj for obj in encontrados})
+        return [objetos[(bool(fila[3]), fila[0])] for fila in filas if (bool(fila[3]), fila[0]) in objetos]
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -77,13 +163,49 @@ class EventoListView(ListView):
         context['responsable_query'] = self.request.GET.get('responsable', '')
         context['lugar_query'] = self.request.GET.get('lugar', '')
         context['modulo_query'] = self.request.GET.get('modulo', '')
+        context['archivo_query'] = self.incluir_archivo()
+        context['facetas'] = self.get_facetas()
         return context
 
+    def get_facetas(self):
+        """
+        Devuelve las facetas del conjunto filtrado (cacheadas por combinación de filtros)
+        con el enlace que aplica o quita cada refinamiento.
+        """
+        filtros = {clave: self.request.GET[clave] for clave in PARAMETROS_FILTRO if self.request.GET.get(clave)}
+        conteos = get_or_build_facetas(
+            filtros, lambda: contar_facetas(filtrar_eventos(Evento.objects.all(), self.request.GET))
+        )
+
+        facetas = []
+        for campo in FACETAS:
+            valores = []
+            for pk, nombre, total in conteos[campo]:
+                params = self.request.GET.copy()
+                params.pop('page', None)
+                activo = params.get(f'{campo}_id') == str(pk)
+                if activo:
+                    params.pop(f'{campo}_id')
+                else:
+                    params[f'{campo}_id'] = pk
+                valores.append({'nombre': nombre, 'total': total, 'activo': activo, 'url': '?' + params.urlencode()})
+            facetas.append({'campo': campo, 'titulo': FACETAS[campo], 'valores': valores})
+        return facetas
+
 class EventoDetailView(DetailView):
     """
     Vista para mostrar los detalles de un solo evento.
     """
     model = Evento
+    template_name = 'eventos/evento_detail.html'
+    context_object_name = 'evento'
+
+    def get_object(self, queryset=None):
+        try:
+            return super().get_object(queryset)
+        except Http404:
+            # Si el evento ya se ha archivado lo leemos del archivo
+            return get_object_or_404(EventoArchivado, pk=self.kwargs['pk'])
 
     
 class EventoCreate(LoginRequiredMixin, CreateView):
@@ -113,23 +235,185 @@ class EventoDelete(OwnerOrSuperuserRequiredMixin, DeleteView):
     def get_success_url(self):
         return reverse_lazy('eventos:evento_list') + '?ok'
 
+@method_decorator(staff_member_required, name="dispatch")
+class EventoReprogramar(FormView):
+    """
+    Vista para el personal que mueve varios eventos a la vez (fecha, horario o lugar).
+    Los eventos llegan seleccionados en el parámetro `ids`, desde la lista o desde el admin.
+    """
+    form_class = ReprogramarEventosForm
+    template_name = 'eventos/evento_reprogramar.html'
+
+    def get_initial(self):
+        initial = super().get_initial()
+        initial['eventos'] = self.request.GET.getlist('ids')
+        return initial
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        form = context['form']
+        ids = form['eventos'].value() or []
+        context['eventos_seleccionados'] = Evento.objects.filter(pk__in=ids).select_related('lugar')
+        return context
+
+    def form_valid(self, form):
+        try:
+            form.save()
+        except ValidationError as error:
+            # Otra reprogramación ha ocupado alguno de los huecos tras validar el formulario
+            form.add_error(None, error)
+            return self.form_invalid(form)
+        return super().form_valid(form)
+
+    def get_success_url(self):
+        return reverse_lazy('eventos:evento_list') + '?ok'
+
+# Modelo asociado a cada ámbito del calendario
+MODELOS_AMBITO = {
+    AMBITO_MODULO: Modulo,
+    AMBITO_LUGAR: Lugar,
+}
+
 # Vista de la API para el calendario
 class EventoApiView(View):
+    """
+    Devuelve los eventos en el formato de Full Calendar. Con `ambito` se limita a
+    los eventos de un módulo o de un lugar, y cada ámbito se cachea por separado.
+    """
+    ambito = AMBITO_GLOBAL
+
     def get(self, request, *args, **kwargs):
-        eventos = Evento.objects.all()
-        
-        eventos_formateados = []
-        for evento in eventos:
-            eventos_formateados.append({
-                'title': evento.titulo,
-                # Usamos .isoformat() para formatear las fechas y horas correctamente
-                'start': f"{evento.fecha.isoformat()}T{evento.hora_inicio.isoformat()}",
-                'end': f"{evento.fecha.isoformat()}T{evento.hora_fin.isoformat()}",
-                'url': reverse('eventos:evento_detail', args=[evento.pk])
-            })
-        
-        return JsonResponse(eventos_formateados, safe=False)
+        pk = kwargs.get('pk')
+
+        def construir_feed():
+            if self.ambito in MODELOS_AMBITO:
+                get_object_or_404(MODELOS_AMBITO[self.ambito], pk=pk)
+            eventos = Evento.objects.por_ambito(self.ambito, pk).values(
+                'pk', 'titulo', 'fecha', 'hora_inicio', 'hora_fin'
+            )
+
+            eventos_formateados = []
+            for evento in eventos:
+                eventos_formateados.append({
+                    'title': evento['titulo'],
+                    # Usamos .isoformat() para formatear las fechas y horas correctamente
+                    'start': f"{evento['fecha'].isoformat()}T{evento['hora_inicio'].isoformat()}",
+                    'end': f"{evento['fecha'].isoformat()}T{evento['hora_fin'].isoformat()}",
+                    'url': reverse('eventos:evento_detail', args=[evento['pk']])
+                })
+            return eventos_formateados
+
+        return JsonResponse(get_or_build_feed(self.ambito, pk, construir_feed), safe=False)
 
 # Vista para el calendario (renderiza la plantilla)
 class CalendarioView(TemplateView):
-    template_name = 'eventos/calendario.html'
\ No newline at end of file
+    template_name = 'eventos/calendario.html'
+    ambito = AMBITO_GLOBAL
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.ambito in MODELOS_AMBITO:
+            # El calendario de un módulo o lugar carga solo su propio feed
+            context['ambito_objeto'] = get_object_or_404(MODELOS_AMBITO[self.ambito], pk=self.kwargs['pk'])
+            context['feed_url'] = reverse(f'eventos:lista_eventos_api_{self.ambito}', args=[self.kwargs['pk']])
+        else:
+            context['feed_url'] = reverse('eventos:lista_eventos_api')
+        return context
+
+# Número máximo de días que se pueden pedir de una vez en la agenda por salas
+AGENDA_MAX_DIAS = 31
+
+def rango_agenda(params):
+    """
+    Lee el rango de fechas de la agenda de los parámetros GET (`fecha` o `desde`/`hasta`).
+    Por defecto devuelve el día de hoy según TIME_ZONE. Lanza ValueError si el rango
+    no es válido.
+    """
+    desde_str = params.get('desde') or params.get('fecha')
+    hasta_str = params.get('hasta') or params.get('fecha')
+    desde = date.fromisoformat(desde_str) if desde_str else timezone.localdate()
+    hasta = date.fromisoformat(hasta_str) if hasta_str else desde
+    if hasta < desde or hasta - desde > timedelta(days=AGENDA_MAX_DIAS - 1):
+        raise ValueError("Rango de fechas no válido.")
+    return desde, hasta
+
+def construir_agenda(desde, hasta, agrupar):
+    """
+    Devuelve los eventos del rango agrupados por lugar (o por módulo) con una
+    única consulta ordenada y `itertools.groupby`, sin consultas por sala.
+    """
+    if agrupar == AMBITO_MODULO:
+        # Recorremos la tabla intermedia para que cada evento aparezca en todos sus módulos
+        filas = Evento.modulo.through.objects.filter(
+            evento__fecha__range=(desde, hasta)
+        ).order_by(
+            'modulo__nombre', 'modulo_id', 'evento__fecha', 'evento__hora_inicio'
+        ).values_list(
+            'modulo_id', 'modulo__nombre', 'evento_id', 'evento__titulo',
+            'evento__fecha', 'evento__hora_inicio', 'evento__hora_fin'
+        )
+    else:
+        filas = Evento.objects.filter(
+            fecha__range=(desde, hasta)
+        ).order_by(
+            'lugar__nombre', 'lugar_id', 'fecha', 'hora_inicio'
+        ).values_list(
+            'lugar_id', 'lugar__nombre', 'pk', 'titulo', 'fecha', 'hora_inicio', 'hora_fin'
+        )
+
+    agenda = []
+    for (grupo_id, grupo_nombre), eventos in groupby(filas, key=lambda fila: fila[:2]):
+        agenda.append({
+            'id': grupo_id,
+            'nombre': grupo_nombre,
+            'eventos': [{
+                'id': pk,
+                'title': titulo,
+                'start': f"{fecha.isoformat()}T{hora_inicio.isoformat()}",
+                'end': f"{fecha.isoformat()}T{hora_fin.isoformat()}",
+                'url': reverse('eventos:evento_detail', args=[pk]),
+            } for _, _, pk, titulo, fecha, hora_inicio, hora_fin in eventos],
+        })
+    return agenda
+
+class AgendaMixin:
+    """
+    Mixin que resuelve el rango y la agrupación de la agenda y la sirve desde la caché.
+    """
+    def get_agenda(self):
+        desde, hasta = rango_agenda(self.request.GET)
+        agrupar = AMBITO_MODULO if self.request.GET.get('agrupar') == AMBITO_MODULO else AMBITO_LUGAR
+        agenda = get_or_build_agenda(desde, hasta, agrupar, lambda: construir_agenda(desde, hasta, agrupar))
+        return desde, hasta, agrupar, agenda
+
+# API de la agenda por salas
+class AgendaApiView(AgendaMixin, View):
+    def get(self, request, *args, **kwargs):
+        try:
+            desde, hasta, agrupar, agenda = self.get_agenda()
+        except ValueError:
+            return JsonResponse({'error': 'Rango de fechas no válido.'}, status=400)
+        return JsonResponse({
+            'desde': desde.isoformat(),
+            'hasta': hasta.isoformat(),
+            'agrupar': agrupar,
+            'grupos': agenda,
+        })
+
+# Vista de la agenda por salas (renderiza la plantilla)
+class AgendaView(AgendaMixin, TemplateView):
+    template_name = 'eventos/agenda.html'
+
+    def get(self, request, *args, **kwargs):
+        # Un rango mal formado es un error del cliente, igual que en la API
+        try:
+            self.agenda = self.get_agenda()
+        except ValueError:
+            return HttpResponseBadRequest("Rango de fechas no válido.")
+        return super().get(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        desde, hasta, agrupar, agenda = self.agenda
+        context.update({'desde': desde, 'hasta': hasta, 'agrupar': agrupar, 'agenda': agenda})
+        return context
@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class MessengerConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "messenger"
+
+    def ready(self):
+        from .fts import restore_triggers
+        post_migrate.connect(restore_triggers, sender=self)
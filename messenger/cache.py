@@ -0,0 +1,25 @@
+# messenger/cache.py
+import time
+from django.core.cache import cache
+
+
+def unread_version_key(user_id):
+    return f'messenger:unread:{user_id}'
+
+
+def unread_version(user_id):
+    """
+    Devuelve la versión de los contadores de no leídos de un usuario, que sirve de ETag.
+    El valor inicial es la hora en nanosegundos para que una clave expulsada de la
+    caché nunca vuelva a dar una versión ya entregada a un cliente.
+    """
+    return cache.get_or_set(unread_version_key(user_id), time.time_ns(), None)
+
+
+def invalidar_unread(user_ids):
+    """
+    Deja obsoletos los contadores de no leídos de los usuarios indicados.
+    """
+    keys = [unread_version_key(user_id) for user_id in set(user_ids)]
+    if keys:
+        cache.delete_many(keys)
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+# Número máximo de eventos pendientes por conexión antes de empezar a descartarlos
+QUEUE_SIZE = 100
+
+# Segundos entre comentarios de keepalive cuando no hay mensajes nuevos
+KEEPALIVE_INTERVAL = 25
+
+
+class MessageBroker:
+    """
+    Pub/sub en memoria para avisar de los mensajes nuevos a las conexiones SSE abiertas.
+    Cada conexión tiene su propia asyncio.Queue; publish() se puede llamar desde código
+    síncrono (vistas, señales) porque entrega los eventos con call_soon_threadsafe.
+    Sólo funciona dentro de un mismo proceso, sin Redis ni Channels.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        subscription = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[user_id]
+
+    def has_subscribers(self, user_ids=None):
+        with self._lock:
+            if user_ids is None:
+                return bool(self._subscribers)
+            return any(user_id in self._subscribers for user_id in user_ids)
+
+    def publish(self, user_ids, event):
+        with self._lock:
+            subscriptions = [s for user_id in user_ids for s in self._subscribers.get(user_id, ())]
+        for loop, queue in subscriptions:
+            try:
+                loop.call_soon_threadsafe(_put_nowait, queue, event)
+            except RuntimeError:
+                # El bucle de esa conexión ya se ha cerrado
+                pass
+
+
+def _put_nowait(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        # Un cliente que no lee no debe hacer crecer la memoria del servidor
+        pass
+
+
+broker = MessageBroker()
+
+
+def message_event(message):
+    return {
+        'id': message.pk,
+        'thread': message.thread_id,
+        'user': message.user.username,
+        'user_id': message.user_id,
+        'content': message.content,
+        'created': message.created.isoformat(),
+    }
+
+
+async def stream_events(user_id, keepalive=KEEPALIVE_INTERVAL):
+    """
+    Generador asíncrono con el flujo SSE de un usuario: un evento por mensaje nuevo
+    en sus hilos y un comentario de keepalive cuando no hay actividad.
+    """
+    subscription = broker.subscribe(user_id)
+    _, queue = subscription
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield f"id: {event['id']}\nevent: message\ndata: {json.dumps(event)}\n\n"
+    finally:
+        broker.unsubscribe(user_id, subscription)
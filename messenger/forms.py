@@ -0,0 +1,36 @@
+from django import forms
+from django.contrib.auth import get_user_model
+from .models import Thread
+
+User = get_user_model()
+
+
+class BroadcastForm(forms.Form):
+    """
+    Formulario para enviar el mismo aviso a todo un departamento.
+    """
+    department = forms.ChoiceField(
+        label="Departamento",
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    content = forms.CharField(
+        label="Mensaje",
+        widget=forms.Textarea(attrs={'class': 'form-control', 'rows': 4})
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        departments = User.objects.exclude(departamento='').order_by('departamento') \
+            .values_list('departamento', flat=True).distinct()
+        self.fields['department'].choices = [(d, d) for d in departments]
+
+    def clean_content(self):
+        content = self.cleaned_data['content'].strip()
+        if not content:
+            raise forms.ValidationError("El mensaje no puede estar vacío.")
+        return content
+
+    def save(self, sender):
+        return Thread.objects.broadcast(
+            sender, self.cleaned_data['department'], self.cleaned_data['content']
+        )
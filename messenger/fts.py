@@ -0,0 +1,57 @@
+# messenger/fts.py
+from django.db import connections
+
+# Tabla virtual FTS5 con el índice de Message.content. Es una tabla de contenido
+# externo: sólo guarda el índice y lee el texto de messenger_message
+FTS_TABLE = 'messenger_message_fts'
+
+INSTALL_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        content, content='messenger_message', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    # Los disparadores mantienen el índice también con bulk_create, update() y los
+    # borrados en cascada, que no lanzan señales
+    f"""CREATE TRIGGER IF NOT EXISTS messenger_message_fts_insert AFTER INSERT ON messenger_message BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS messenger_message_fts_delete AFTER DELETE ON messenger_message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS messenger_message_fts_update AFTER UPDATE OF content ON messenger_message BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content);
+    END""",
+]
+
+REBUILD_SQL = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+
+UNINSTALL_SQL = [
+    'DROP TRIGGER IF EXISTS messenger_message_fts_insert',
+    'DROP TRIGGER IF EXISTS messenger_message_fts_delete',
+    'DROP TRIGGER IF EXISTS messenger_message_fts_update',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+
+def install(connection, rebuild=False):
+    """
+    Crea la tabla y los disparadores que falten y, con `rebuild`, reconstruye el índice
+    desde messenger_message. El índice usa FTS5, así que sólo se hace en SQLite.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for sql in INSTALL_SQL + ([REBUILD_SQL] if rebuild else []):
+            cursor.execute(sql)
+
+
+def restore_triggers(sender, using, **kwargs):
+    """
+    Receptor de post_migrate: SQLite borra los disparadores al rehacer la tabla de
+    mensajes en una migración (cualquier AlterField sobre Message), así que se vuelven
+    a crear después de cada migrate. Los ids no cambian al rehacer la tabla, por lo que
+    el índice sigue siendo válido.
+    """
+    if 'messenger_message' in connections[using].introspection.table_names():
+        install(connections[using])
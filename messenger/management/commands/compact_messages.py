@@ -0,0 +1,78 @@
+# messenger/management/commands/compact_messages.py
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from messenger.models import Message, MessageArchive, Thread
+
+
+class Command(BaseCommand):
+    help = ("Pasa los mensajes más antiguos que la retención a bloques comprimidos por hilo, "
+            "en lotes cortos para no bloquear la base de datos.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.MESSENGER_RETENTION_DAYS,
+                            help="Se archivan los mensajes con más días que éstos.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Número de mensajes por lote (y por bloque del archivo).")
+        parser.add_argument('--pause', type=float, default=0,
+                            help="Segundos de espera entre lotes para dejar paso a otras escrituras.")
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError("La retención debe ser de al menos un día.")
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError("El tamaño de lote debe ser mayor que cero.")
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        thread_ids = Message.objects.filter(
+            created__lt=cutoff, thread__isnull=False
+        ).order_by().values_list('thread_id', flat=True).distinct()
+        threads = Thread.objects.filter(pk__in=list(thread_ids)).values_list('pk', 'last_message_id')
+
+        total = 0
+        for thread_id, last_message_id in threads:
+            while True:
+                compacted = self.compact_batch(thread_id, last_message_id, cutoff, batch_size)
+                if not compacted:
+                    break
+                total += compacted
+                self.stdout.write(f"{total} mensajes archivados...")
+                if options['pause']:
+                    time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archivados {total} mensajes anteriores a {cutoff:%Y-%m-%d}."
+        ))
+
+    def compact_batch(self, thread_id, last_message_id, cutoff, batch_size):
+        """
+        Comprime un lote de mensajes antiguos de un hilo en un bloque del archivo y los
+        borra de la tabla activa en una transacción corta. El último mensaje del hilo
+        nunca se archiva para que la bandeja de entrada siga mostrándolo.
+        """
+        with transaction.atomic():
+            rows = list(
+                Message.objects.filter(thread_id=thread_id, created__lt=cutoff)
+                .exclude(pk=last_message_id)
+                .order_by('created', 'pk')
+                .values_list('pk', 'user_id', 'created', 'content')[:batch_size]
+            )
+            if not rows:
+                return 0
+            MessageArchive.objects.create(
+                thread_id=thread_id,
+                first_message_id=rows[0][0],
+                last_message_id=rows[-1][0],
+                first_created=rows[0][2],
+                last_created=rows[-1][2],
+                message_count=len(rows),
+                data=MessageArchive.pack(rows),
+            )
+            Message.objects.filter(pk__in=[row[0] for row in rows]).delete()
+            Thread.objects.filter(pk=thread_id).update(archived_count=F('archived_count') + len(rows))
+        return len(rows)
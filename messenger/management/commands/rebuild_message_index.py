@@ -0,0 +1,12 @@
+# messenger/management/commands/rebuild_message_index.py
+from django.core.management.base import BaseCommand
+from messenger.models import Message
+from messenger.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el índice de búsqueda de texto completo (FTS5) de los mensajes."
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Índice reconstruido con {Message.objects.count()} mensajes."))
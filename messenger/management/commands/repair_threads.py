@@ -0,0 +1,11 @@
+# messenger/management/commands/repair_threads.py
+from django.core.management.base import BaseCommand
+from messenger.models import Thread
+
+
+class Command(BaseCommand):
+    help = "Recalcula en bloque el contador de mensajes y el último mensaje de todos los hilos."
+
+    def handle(self, *args, **options):
+        total = Thread.objects.recompute_message_fields()
+        self.stdout.write(self.style.SUCCESS(f"Recalculados {total} hilos."))
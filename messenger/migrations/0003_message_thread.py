@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messenger", "0002_alter_thread_options_thread_updated"),
+    ]
+
+    operations = [
+        # El M2M antiguo usa "thread" como nombre de consulta inversa, así que
+        # lo apartamos mientras convive con la nueva clave foránea
+        migrations.AlterField(
+            model_name="thread",
+            name="messages",
+            field=models.ManyToManyField(
+                related_name="old_threads",
+                related_query_name="old_thread",
+                to="messenger.message",
+            ),
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="thread",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="messenger.thread",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["thread", "created"], name="messenger_thread_created_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:00
+
+from django.db import migrations
+
+# Número de filas de la tabla intermedia que se procesan en cada lote
+BATCH_SIZE = 1000
+
+
+def backfill_message_thread(apps, schema_editor):
+    """
+    Copia el hilo de cada mensaje desde la tabla intermedia del M2M a la nueva
+    clave foránea, por lotes para no cargar toda la tabla en memoria.
+    """
+    Thread = apps.get_model("messenger", "Thread")
+    Message = apps.get_model("messenger", "Message")
+    Through = Thread._meta.get_field("messages").remote_field.through
+
+    last_id = 0
+    while True:
+        rows = list(
+            Through.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", "thread_id", "message_id")[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        message_ids_by_thread = {}
+        for _, thread_id, message_id in rows:
+            message_ids_by_thread.setdefault(thread_id, []).append(message_id)
+        # Si un mensaje estaba en varios hilos se queda en el primero
+        for thread_id, message_ids in message_ids_by_thread.items():
+            Message.objects.filter(pk__in=message_ids, thread__isnull=True).update(thread_id=thread_id)
+
+
+def restore_thread_messages(apps, schema_editor):
+    """
+    Reconstruye la tabla intermedia del M2M a partir de la clave foránea.
+    """
+    Thread = apps.get_model("messenger", "Thread")
+    Message = apps.get_model("messenger", "Message")
+    Through = Thread._meta.get_field("messages").remote_field.through
+
+    last_id = 0
+    while True:
+        rows = list(
+            Message.objects.filter(id__gt=last_id, thread__isnull=False)
+            .order_by("id")
+            .values_list("id", "thread_id")[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        Through.objects.bulk_create(
+            [Through(thread_id=thread_id, message_id=message_id) for message_id, thread_id in rows],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messenger", "0003_message_thread"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_message_thread, restore_thread_messages),
+    ]
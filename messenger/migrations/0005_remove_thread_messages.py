@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messenger", "0004_backfill_message_thread"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="thread",
+            name="messages",
+        ),
+        migrations.AlterField(
+            model_name="message",
+            name="thread",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="messages",
+                to="messenger.thread",
+            ),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_user_pair(apps, schema_editor):
+    """
+    Rellena el par canónico de los hilos entre dos personas. Si hay varios hilos
+    para el mismo par se fusionan en el más antiguo antes de crear la restricción.
+    """
+    Thread = apps.get_model("messenger", "Thread")
+    Message = apps.get_model("messenger", "Message")
+    users_field = Thread._meta.get_field("users")
+    Members = users_field.remote_field.through
+    user_column = users_field.m2m_reverse_field_name() + "_id"
+
+    user_ids_by_thread = {}
+    for thread_id, user_id in Members.objects.order_by("thread_id").values_list("thread_id", user_column).iterator():
+        user_ids_by_thread.setdefault(thread_id, set()).add(user_id)
+
+    threads_by_pair = {}
+    for thread_id, user_ids in sorted(user_ids_by_thread.items()):
+        if len(user_ids) == 2:
+            threads_by_pair.setdefault(tuple(sorted(user_ids)), []).append(thread_id)
+
+    for (user_low_id, user_high_id), thread_ids in threads_by_pair.items():
+        keep_id, duplicate_ids = thread_ids[0], thread_ids[1:]
+        if duplicate_ids:
+            Message.objects.filter(thread_id__in=duplicate_ids).update(thread_id=keep_id)
+            Thread.objects.filter(pk__in=duplicate_ids).delete()
+        Thread.objects.filter(pk=keep_id).update(user_low_id=user_low_id, user_high_id=user_high_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messenger", "0005_remove_thread_messages"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thread",
+            name="user_high",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="user_low",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.RunPython(backfill_user_pair, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="thread",
+            constraint=models.UniqueConstraint(
+                fields=("user_low", "user_high"), name="messenger_thread_user_pair"
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:22
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_message_count(apps, schema_editor):
+    """
+    Rellena el contador de mensajes de todos los hilos con un solo UPDATE.
+    """
+    Thread = apps.get_model("messenger", "Thread")
+    Message = apps.get_model("messenger", "Message")
+    counts = (
+        Message.objects.filter(thread=OuterRef("pk"))
+        .order_by()
+        .values("thread")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    Thread.objects.update(
+        message_count=Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messenger", "0007_readpointer"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="idempotency_key",
+            field=models.CharField(blank=True, max_length=80, null=True),
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="message_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name="message",
+            constraint=models.UniqueConstraint(
+                fields=("user", "idempotency_key"),
+                name="messenger_message_idempotency",
+            ),
+        ),
+        migrations.RunPython(backfill_message_count, migrations.RunPython.noop),
+    ]
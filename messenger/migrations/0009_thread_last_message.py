@@ -0,0 +1,53 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_last_message(apps, schema_editor):
+    """
+    Rellena el último mensaje y su fecha de todos los hilos con un solo UPDATE.
+    """
+    Thread = apps.get_model("messenger", "Thread")
+    Message = apps.get_model("messenger", "Message")
+    last = Message.objects.filter(thread=OuterRef("pk")).order_by("-created", "-pk")
+    Thread.objects.update(
+        last_message_id=Subquery(last.values("pk")[:1]),
+        last_message_at=Subquery(last.values("created")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messenger", "0008_message_idempotency_thread_message_count"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thread",
+            name="last_message",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="messenger.message",
+            ),
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="last_message_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="thread",
+            index=models.Index(
+                fields=["last_message_at"], name="messenger_thread_last_msg_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+from messenger.fts import INSTALL_SQL, REBUILD_SQL, UNINSTALL_SQL
+
+# La definición del índice vive en messenger.fts, que también usan la búsqueda y el
+# receptor de post_migrate que recrea los disparadores
+
+
+def run_sqlite(statements):
+    """
+    El índice usa FTS5, así que sólo se crea en SQLite.
+    """
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != "sqlite":
+            return
+        for sql in statements:
+            schema_editor.execute(sql)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messenger", "0009_thread_last_message"),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sqlite(INSTALL_SQL + [REBUILD_SQL]), run_sqlite(UNINSTALL_SQL)),
+    ]
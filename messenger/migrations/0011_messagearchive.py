@@ -0,0 +1,57 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messenger", "0010_message_fts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thread",
+            name="archived_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name="MessageArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("first_message_id", models.BigIntegerField()),
+                ("last_message_id", models.BigIntegerField()),
+                ("first_created", models.DateTimeField()),
+                ("last_created", models.DateTimeField()),
+                ("message_count", models.PositiveIntegerField()),
+                ("data", models.BinaryField()),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                (
+                    "thread",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archives",
+                        to="messenger.thread",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["first_created"],
+                "indexes": [
+                    models.Index(
+                        fields=["thread", "last_created"],
+                        name="messenger_archive_thread_idx",
+                    )
+                ],
+            },
+        ),
+    ]
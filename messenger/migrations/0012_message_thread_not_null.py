@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Número de mensajes sin hilo que se borran en cada lote
+BATCH_SIZE = 1000
+
+
+def delete_orphan_messages(apps, schema_editor):
+    """
+    Borra los mensajes que se quedaron sin hilo tras 0004 (nunca se añadieron a
+    ninguno, así que nadie podía verlos), por lotes.
+    """
+    Message = apps.get_model("messenger", "Message")
+    while True:
+        pks = list(Message.objects.filter(thread__isnull=True).order_by("pk").values_list("pk", flat=True)[:BATCH_SIZE])
+        if not pks:
+            break
+        Message.objects.filter(pk__in=pks).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("messenger", "0011_messagearchive"),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_orphan_messages, migrations.RunPython.noop),
+        # En SQLite rehace la tabla y borra los disparadores del índice FTS5; los vuelve
+        # a crear el receptor de post_migrate de messenger.fts
+        migrations.AlterField(
+            model_name="message",
+            name="thread",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="messages",
+                to="messenger.thread",
+            ),
+        ),
+    ]
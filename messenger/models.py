@@ -1,65 +1,530 @@
-from django.db import models
-from django.db.models.signals import m2m_changed
+import json
+import zlib
+from django.db import IntegrityError, models, transaction
+from django.db.models import (
+    Case, Count, DateTimeField, F, FilteredRelation, IntegerField, OuterRef, Prefetch, Q, Subquery, Value, When,
+)
+from django.db.models.functions import Coalesce, Substr
+from django.db.models.signals import m2m_changed, post_save
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .cache import invalidar_unread
+from .events import broker, message_event
 
 # Obtiene la clase del modelo de usuario
 User = get_user_model()
 
 
 class Message(models.Model):
+    # Los mensajes se añaden a un hilo creándolos con thread=... o con Thread.add_messages()
+    thread = models.ForeignKey('Thread', on_delete=models.CASCADE, related_name='messages')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     created = models.DateTimeField(auto_now_add=True)
+    # Clave que envía el cliente para que reintentar un envío no duplique el mensaje
+    idempotency_key = models.CharField(max_length=80, null=True, blank=True)
+
+    # Los mensajes leídos de un MessageArchive lo tienen a True
+    archived = False
 
     class Meta:
         ordering = ['created']
+        indexes = [
+            models.Index(fields=['thread', 'created'], name='messenger_thread_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], name='messenger_message_idempotency'),
+        ]
+
+
+# Número de caracteres del último mensaje que se muestran en la bandeja de entrada
+SNIPPET_LENGTH = 80
+
+# Número de mensajes que se cargan de cada vez en el detalle de un hilo
+MESSAGES_PAGE_SIZE = 30
+
+# Número máximo de mensajes que se pueden enviar en una sola petición
+SEND_BATCH_SIZE = 10
+
+# Longitud máxima de la clave de idempotencia que envía el cliente
+IDEMPOTENCY_KEY_LENGTH = 64
+
+
+def make_cursor(message):
+    return f'{message.created.isoformat()},{message.pk}'
+
+
+def parse_cursor(cursor):
+    """
+    Convierte un cursor "<created>,<id>" en (datetime, id). Lanza ValueError si no es válido.
+    """
+    created, _, pk = cursor.rpartition(',')
+    created = parse_datetime(created)
+    if created is None or not pk.isdigit():
+        raise ValueError("Cursor no válido")
+    return created, int(pk)
 
 
 class ThreadManager(models.Manager):
+    def inbox(self, user):
+        """
+        Devuelve los hilos con mensajes del usuario, con el otro participante (y su perfil),
+        el inicio del último mensaje, su fecha y los mensajes sin leer, en dos consultas
+        sea cual sea el número de hilos. El último mensaje y su fecha salen de los campos
+        desnormalizados del hilo, y el orden del índice sobre last_message_at.
+        Se consideran sin leer los mensajes de los demás posteriores al puntero de
+        lectura del usuario en el hilo.
+        """
+        last_read = ReadPointer.objects.filter(
+            thread=OuterRef(OuterRef('pk')), user=user
+        ).values('last_read_id')[:1]
+        unread = Message.objects.filter(thread=OuterRef('pk')).exclude(user=user).filter(
+            pk__gt=Coalesce(Subquery(last_read), Value(0))
+        ).order_by().values('thread').annotate(total=Count('pk')).values('total')
+
+        threads = self.filter(
+            # Sólo mostramos un hilo si tiene como mínimo 1 mensaje
+            users=user, last_message_at__isnull=False
+        ).annotate(
+            last_message_snippet=Substr('last_message__content', 1, SNIPPET_LENGTH),
+            unread_count=Coalesce(Subquery(unread, output_field=IntegerField()), Value(0)),
+        ).order_by('-last_message_at', '-pk').prefetch_related(
+            Prefetch('users', queryset=User.objects.exclude(pk=user.pk).select_related('profile'), to_attr='others')
+        )
+
+        threads = list(threads)
+        for thread in threads:
+            thread.other = thread.others[0] if thread.others else None
+            profile = getattr(thread.other, 'profile', None) if thread.other else None
+            thread.avatar_url = profile.avatar_thumbnail_url if profile else None
+        return threads
+
+    def unread_counts(self, user):
+        """
+        Devuelve {id del hilo: mensajes sin leer} de los hilos del usuario que tienen
+        alguno, en una sola consulta agregada. El puntero de lectura se une con un
+        LEFT JOIN por su índice único (user, thread) y los mensajes se recorren por el
+        índice de thread_id a partir del último leído.
+        """
+        counts = Message.objects.filter(thread__users=user).exclude(user=user).annotate(
+            pointer=FilteredRelation('thread__read_pointers', condition=Q(thread__read_pointers__user=user)),
+        ).filter(
+            # El OR hace que Django use LEFT JOIN: sin puntero todo está sin leer
+            Q(pointer__isnull=True) | Q(pk__gt=F('pointer__last_read_id'))
+        ).order_by().values('thread').annotate(unread=Count('pk'))
+        return {row['thread']: row['unread'] for row in counts}
+
+    def recompute_message_fields(self, thread_ids=None):
+        """
+        Recalcula en un solo UPDATE los contadores, el último mensaje y su fecha de todos
+        los hilos (o sólo de `thread_ids`) a partir de la tabla de mensajes y del archivo.
+        Devuelve el número de hilos.
+        """
+        messages = Message.objects.filter(thread=OuterRef('pk'))
+        last = messages.order_by('-created', '-pk')
+        archived = Coalesce(Subquery(
+            MessageArchive.objects.filter(thread=OuterRef('pk')).order_by().values('thread')
+            .annotate(total=models.Sum('message_count')).values('total'),
+            output_field=IntegerField(),
+        ), Value(0))
+        threads = self.get_queryset()
+        if thread_ids is not None:
+            threads = threads.filter(pk__in=thread_ids)
+        return threads.update(
+            message_count=Coalesce(Subquery(
+                messages.order_by().values('thread').annotate(total=Count('pk')).values('total'),
+                output_field=IntegerField(),
+            ), Value(0)) + archived,
+            archived_count=archived,
+            last_message_id=Subquery(last.values('pk')[:1]),
+            last_message_at=Subquery(last.values('created')[:1]),
+        )
+
+    def for_pairs(self, user, others):
+        """
+        Devuelve {id del otro usuario: id del hilo} con los hilos de `user` con cada uno
+        de `others`, creando en bloque los que falten (hilos y miembros). Son dos o tres
+        consultas más dos inserciones sea cual sea el número de usuarios.
+        """
+        others = [pk for pk in set(others) if pk != user.pk]
+
+        def existing():
+            pairs = self.filter(
+                Q(user_low_id=user.pk, user_high_id__in=others) | Q(user_high_id=user.pk, user_low_id__in=others)
+            ).values_list('pk', 'user_low_id', 'user_high_id')
+            return {high if low == user.pk else low: pk for pk, low, high in pairs}
+
+        threads = existing()
+        missing = [pk for pk in others if pk not in threads]
+        if missing:
+            with transaction.atomic():
+                # ignore_conflicts por si otra petición crea a la vez alguno de los hilos
+                self.bulk_create([Thread(user_low_id=min(user.pk, pk), user_high_id=max(user.pk, pk))
+                                  for pk in missing], ignore_conflicts=True)
+                created = {other: pk for other, pk in existing().items() if other not in threads}
+                Members = Thread.users.through
+                member_column = Thread.users.field.m2m_reverse_field_name()
+                Members.objects.bulk_create([
+                    Members(thread_id=thread_id, **{f'{member_column}_id': member_id})
+                    for other, thread_id in created.items() for member_id in (user.pk, other)
+                ], ignore_conflicts=True)
+            threads.update(created)
+        return threads
+
+    def broadcast(self, sender, department, content):
+        """
+        Envía el mismo mensaje a todos los usuarios activos de un departamento, cada uno
+        en su hilo con `sender`. Resuelve o crea los hilos en bloque, inserta los mensajes
+        con bulk_create y actualiza los contadores y el último mensaje de todos los hilos
+        en un solo UPDATE. Devuelve el número de destinatarios.
+        """
+        recipients = list(User.objects.filter(departamento=department, is_active=True)
+                          .exclude(pk=sender.pk).values_list('pk', flat=True))
+        if not recipients:
+            return 0
+        with transaction.atomic():
+            threads = self.for_pairs(sender, recipients)
+            messages = Message.objects.bulk_create([
+                Message(thread_id=thread_id, user=sender, content=content) for thread_id in threads.values()
+            ])
+            last = Message.objects.filter(thread=OuterRef('pk')).order_by('-created', '-pk')
+            self.filter(pk__in=list(threads.values())).update(
+                updated=timezone.now(),
+                message_count=F('message_count') + 1,
+                last_message_id=Subquery(last.values('pk')[:1]),
+                last_message_at=Subquery(last.values('created')[:1]),
+            )
+
+        deliveries = [(recipient, message) for recipient, message in zip(threads, messages)]
+
+        def notify():
+            invalidar_unread(threads)
+            for recipient, message in deliveries:
+                if broker.has_subscribers([recipient]):
+                    broker.publish([recipient], message_event(message))
+
+        transaction.on_commit(notify)
+        return len(recipients)
+
     def find(self, user1, user2):
-        queryset = self.filter(users=user1).filter(users=user2)
-        if len(queryset) > 0:
-            return queryset[0]  
-        return None
+        # Búsqueda directa por el par canónico (id menor, id mayor) usando su índice único
+        user_low_id, user_high_id = sorted([user1.pk, user2.pk])
+        return self.filter(user_low_id=user_low_id, user_high_id=user_high_id).first()
 
     def find_or_create(self, user1, user2):
-        thread = self.find(user1, user2)
-        if thread is None:
-            thread = self.create()
-            thread.users.add(user1, user2)
-        return thread   
+        # get_or_create se apoya en la restricción única, así que dos peticiones
+        # simultáneas nunca crean dos hilos para el mismo par de usuarios
+        if user1.pk == user2.pk:
+            # Un hilo con uno mismo tendría un solo miembro y se quedaría sin par canónico
+            raise ValueError("No se puede crear un hilo de un usuario consigo mismo")
+        user_low_id, user_high_id = sorted([user1.pk, user2.pk])
+        with transaction.atomic():
+            thread, created = self.get_or_create(user_low_id=user_low_id, user_high_id=user_high_id)
+            if created:
+                thread.users.add(user1, user2)
+        return thread
 
 class Thread(models.Model):
     users = models.ManyToManyField(User, related_name='threads')
-    messages = models.ManyToManyField(Message)
     updated= models.DateTimeField(auto_now=True)
+    # Par canónico de los hilos entre dos personas (null en el resto de hilos)
+    user_low = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    user_high = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    # Campos desnormalizados de los mensajes; se mantienen con F() al añadir mensajes
+    # y se pueden recalcular con el comando repair_threads
+    message_count = models.PositiveIntegerField(default=0)
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    # Mensajes que compact_messages ha pasado al archivo (también cuentan en message_count)
+    archived_count = models.PositiveIntegerField(default=0)
 
     objects = ThreadManager()
 
     class Meta:
         ordering = ['-updated']
+        indexes = [
+            models.Index(fields=['last_message_at'], name='messenger_thread_last_msg_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='messenger_thread_user_pair'),
+        ]
+
+    def messages_page(self, cursor=None, limit=MESSAGES_PAGE_SIZE, until=None):
+        """
+        Devuelve (mensajes, cursor) con los `limit` mensajes anteriores al cursor, en orden
+        cronológico. El cursor es "<created>,<id>" del mensaje más antiguo devuelto, o None
+        si no hay más. Con `until` la página termina en ese mensaje (incluido), para
+        saltar a un resultado de búsqueda. Es una sola consulta gracias al índice
+        (thread, created); sólo al llegar al principio de un hilo con mensajes archivados
+        se leen además los bloques del archivo que hagan falta.
+        """
+        messages = self.messages.select_related('user').order_by('-created', '-pk')
+        if cursor:
+            created, pk = parse_cursor(cursor)
+            messages = messages.filter(Q(created__lt=created) | Q(created=created, pk__lt=pk))
+        elif until is not None:
+            messages = messages.filter(Q(created__lt=until.created) | Q(created=until.created, pk__lte=until.pk))
+
+        messages = list(messages[:limit + 1])
+        if len(messages) <= limit and self.archived_count:
+            if messages:
+                before = (messages[-1].created, messages[-1].pk)
+            else:
+                before = parse_cursor(cursor) if cursor else None
+            messages += self.archived_messages(before, limit + 1 - len(messages))
+        next_cursor = None
+        if len(messages) > limit:
+            messages = messages[:limit]
+            next_cursor = make_cursor(messages[-1])
+        messages.reverse()
+        return messages, next_cursor
+
+    def archived_messages(self, before=None, limit=MESSAGES_PAGE_SIZE):
+        """
+        Devuelve, del más reciente al más antiguo, hasta `limit` mensajes archivados
+        anteriores a `before` (una tupla (created, id)). Sólo descomprime los bloques
+        necesarios y carga los autores en una consulta.
+        """
+        archives = self.archives.order_by('-last_created', '-last_message_id')
+        if before is not None:
+            created, pk = before
+            archives = archives.filter(
+                Q(first_created__lt=created) | Q(first_created=created, first_message_id__lt=pk)
+            )
+        messages = []
+        for archive in archives.iterator(chunk_size=4):
+            for message in reversed(archive.messages()):
+                if before is None or (message.created, message.pk) < before:
+                    messages.append(message)
+                    if len(messages) == limit:
+                        break
+            if len(messages) == limit:
+                break
+        users = User.objects.in_bulk({message.user_id for message in messages})
+        for message in messages:
+            message.user = users.get(message.user_id)
+        return messages
+
+    def add_messages(self, *messages):
+        """
+        Añade mensajes al hilo y devuelve los añadidos. Sólo acepta los de autores que son
+        miembros del hilo y descarta el resto. Los mensajes sin guardar se crean con
+        bulk_create; los guardados en otro hilo se mueven a éste y se recalculan los
+        campos desnormalizados de sus hilos de origen. Los que ya son del hilo no se
+        vuelven a contar. Son dos consultas de lectura (miembros y, si hay mensajes
+        guardados, su autor e hilo actuales) sea cual sea el número de mensajes.
+        """
+        members = set(self.users.values_list('pk', flat=True))
+        saved = [message for message in messages if message.pk is not None]
+        current = {pk: (user_id, thread_id) for pk, user_id, thread_id in
+                   Message.objects.filter(pk__in=[message.pk for message in saved])
+                   .values_list('pk', 'user_id', 'thread_id')} if saved else {}
+        new = [message for message in messages if message.pk is None and message.user_id in members]
+        moved = [message for message in saved
+                 if message.pk in current and current[message.pk][0] in members and current[message.pk][1] != self.pk]
+        added = new + moved
+        if not added:
+            return []
+
+        sources = {current[message.pk][1] for message in moved}
+        with transaction.atomic():
+            for message in added:
+                message.thread = self
+            # bulk_create y update() no lanzan post_save, así que se cuenta aquí una sola vez
+            Message.objects.bulk_create(new)
+            if moved:
+                Message.objects.filter(pk__in=[message.pk for message in moved]).update(thread=self)
+                Thread.objects.recompute_message_fields(sources)
+            self.count_messages(len(added), max(added, key=lambda message: (message.created, message.pk)))
+        messages_added(self.pk, added, members)
+        return added
+
+    def send_messages(self, user, contents, idempotency_key=None):
+        """
+        Crea en bloque los mensajes de `user` en el hilo y devuelve (mensajes, first, duplicate).
+        `first` indica si son los primeros mensajes del hilo y se saca del contador
+        desnormalizado. Si ya existen mensajes con la misma clave de idempotencia se
+        devuelven ésos sin crear nada (duplicate=True). La clave es única por usuario:
+        si ya la usó en otro hilo lanza ValueError. No comprueba que el usuario sea
+        miembro del hilo; eso lo hace la vista.
+        """
+        keys = [f'{idempotency_key}:{i}' for i in range(len(contents))] if idempotency_key else [None] * len(contents)
+        if idempotency_key:
+            sent = self._sent_with_keys(user, keys)
+            if sent is not None:
+                return sent
+        try:
+            with transaction.atomic():
+                messages = Message.objects.bulk_create([
+                    Message(thread=self, user=user, content=content, idempotency_key=key)
+                    for content, key in zip(contents, keys)
+                ])
+                self.count_messages(len(messages), messages[-1])
+                self.refresh_from_db(fields=['message_count'])
+        except IntegrityError:
+            # Un reintento simultáneo con la misma clave se nos ha adelantado
+            sent = self._sent_with_keys(user, keys) if idempotency_key else None
+            if sent is None:
+                raise
+            return sent
+        messages_added(self.pk, messages)
+        return messages, self.message_count == len(messages), False
+
+    def _sent_with_keys(self, user, keys):
+        # La restricción única es (user, idempotency_key), así que se busca en todos sus hilos
+        messages = list(Message.objects.filter(user=user, idempotency_key__in=keys).order_by('pk'))
+        if not messages:
+            return None
+        if any(message.thread_id != self.pk for message in messages):
+            raise ValueError("La clave de idempotencia ya se ha usado en otro hilo")
+        first = not Message.objects.filter(thread=self, pk__lt=messages[0].pk).exists()
+        return messages, first, True
+
+    def count_messages(self, delta, last_message=None):
+        """
+        Suma `delta` al contador de mensajes, actualiza la fecha del hilo y, si es más
+        reciente que el actual, guarda `last_message` como último mensaje, todo en un
+        solo UPDATE para que dos envíos simultáneos no se pisen.
+        """
+        self.updated = timezone.now()
+        fields = {'updated': self.updated, 'message_count': F('message_count') + delta}
+        if last_message is not None:
+            newer = Q(last_message_at__isnull=True) | Q(last_message_at__lte=last_message.created)
+            fields['last_message_id'] = Case(
+                When(newer, then=Value(last_message.pk)), default=F('last_message_id'),
+                output_field=models.BigIntegerField(),
+            )
+            fields['last_message_at'] = Case(
+                When(newer, then=Value(last_message.created, output_field=DateTimeField())),
+                default=F('last_message_at'),
+            )
+        Thread.objects.filter(pk=self.pk).update(**fields)
+
+    def mark_read(self, user, message_id=None):
+        """
+        Avanza el puntero de lectura del usuario hasta message_id (por defecto, el último
+        mensaje del hilo). El puntero nunca retrocede ni pasa del último mensaje del hilo,
+        para que un id inventado no deje el hilo sin no leídos para siempre. Devuelve
+        True si ha cambiado.
+        """
+        last = self.messages.aggregate(last=models.Max('pk'))['last'] or 0
+        message_id = last if message_id is None else min(message_id, last)
+        changed = ReadPointer.objects.filter(
+            thread=self, user=user, last_read_id__lt=message_id
+        ).update(last_read_id=message_id)
+        if not changed:
+            _, changed = ReadPointer.objects.get_or_create(
+                thread=self, user=user, defaults={'last_read_id': message_id}
+            )
+        if changed:
+            transaction.on_commit(lambda: invalidar_unread([user.pk]))
+        return bool(changed)
+
+    def update_user_pair(self):
+        """
+        Recalcula el par canónico a partir de los miembros del hilo.
+        """
+        user_ids = sorted(self.users.values_list('pk', flat=True))
+        user_low_id, user_high_id = user_ids if len(user_ids) == 2 else (None, None)
+        if (self.user_low_id, self.user_high_id) != (user_low_id, user_high_id):
+            self.user_low_id, self.user_high_id = user_low_id, user_high_id
+            Thread.objects.filter(pk=self.pk).update(user_low_id=user_low_id, user_high_id=user_high_id)
+
+class ReadPointer(models.Model):
+    # Id del último mensaje leído; no es una clave ajena para que borrar o archivar
+    # mensajes no mueva el puntero
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='read_pointers')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    last_read_id = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'thread'], name='messenger_readpointer_user_thread'),
+        ]
+
+
+class MessageArchive(models.Model):
+    """
+    Bloque de mensajes antiguos de un hilo guardados como JSON comprimido con zlib.
+    Lo escribe el comando compact_messages y se lee al paginar hacia atrás en el hilo.
+    """
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='archives')
+    first_message_id = models.BigIntegerField()
+    last_message_id = models.BigIntegerField()
+    first_created = models.DateTimeField()
+    last_created = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['first_created']
+        indexes = [
+            models.Index(fields=['thread', 'last_created'], name='messenger_archive_thread_idx'),
+        ]
+
+    @staticmethod
+    def pack(rows):
+        """
+        Comprime una lista de (id, user_id, created, content) ordenada por fecha.
+        """
+        payload = [[pk, user_id, created.isoformat(), content] for pk, user_id, created, content in rows]
+        return zlib.compress(json.dumps(payload, separators=(',', ':')).encode(), 9)
+
+    def messages(self):
+        """
+        Devuelve los mensajes del bloque, en orden cronológico, como instancias de
+        Message sin guardar y marcadas como archivadas.
+        """
+        messages = []
+        for pk, user_id, created, content in json.loads(zlib.decompress(self.data)):
+            message = Message(pk=pk, thread_id=self.thread_id, user_id=user_id,
+                              content=content, created=parse_datetime(created))
+            message.archived = True
+            messages.append(message)
+        return messages
+
+
+def messages_added(thread_id, messages, member_ids=None):
+    """
+    Cuando la transacción se confirma, deja obsoletos los contadores de no leídos de
+    los miembros del hilo y avisa de los mensajes nuevos a sus conexiones SSE.
+    """
+    if not messages:
+        return
+    if member_ids is None:
+        member_ids = list(User.objects.filter(threads=thread_id).values_list('pk', flat=True))
+    readers = set(member_ids) - {message.user_id for message in messages}
+    events = [message_event(message) for message in messages] if broker.has_subscribers(member_ids) else []
 
-def messages_changed(sender, **kwargs):
-    instance = kwargs.pop('instance', None)
-    action = kwargs.pop('action', None)
-    pk_set = kwargs.pop('pk_set', None) 
-    print(instance,action, pk_set)
+    def notify():
+        invalidar_unread(readers)
+        for event in events:
+            broker.publish(member_ids, event)
 
-    false_pk_set = set()
-    if action is 'pre_add':
-        for msg_pk in pk_set:
-            msg = Message.objects.get(pk=msg_pk)
-            if msg.user not in instance.users.all():
-                print("Ups, ({}) no forma parte del hilo".format(msg.user))
-                false_pk_set.add(msg_pk)
+    transaction.on_commit(notify)
 
 
-    # Borramos de pk_set los mensajes que concuerdan con los de false_pk_set
-    pk_set.difference_update(false_pk_set)
+def message_created(sender, instance, created, **kwargs):
+    # Los mensajes creados de uno en uno; add_messages() y send_messages() cuentan los suyos
+    if created and instance.thread_id is not None:
+        Thread(pk=instance.thread_id).count_messages(1, instance)
+        messages_added(instance.thread_id, [instance])
 
-    # Forzar la actualización haciendo save
-    instance.save()
 
-# Conectar la señal m2m_changed con la función messages_changed
-m2m_changed.connect(messages_changed, sender=Thread.messages.through)
+def users_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Mantiene el par canónico al día cuando cambian los miembros de un hilo
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        threads = Thread.objects.filter(pk__in=pk_set) if pk_set else []
+    else:
+        threads = [instance]
+    for thread in threads:
+        thread.update_user_pair()
 
+# Conectar la señal m2m_changed con la función users_changed
+m2m_changed.connect(users_changed, sender=Thread.users.through)
+post_save.connect(message_created, sender=Message)
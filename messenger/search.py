@@ -0,0 +1,94 @@
+# messenger/search.py
+import re
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.urls import reverse
+from django.utils.html import escape
+from .fts import FTS_TABLE, install
+from .models import Message, Thread
+
+User = get_user_model()
+
+# Número máximo de resultados de una búsqueda
+SEARCH_LIMIT = 20
+
+# Palabras de contexto alrededor de cada coincidencia en el fragmento
+SNIPPET_TOKENS = 12
+
+# Marcas que FTS5 pone alrededor de cada coincidencia; se sustituyen por <mark>
+# después de escapar el HTML del mensaje
+MARK_START, MARK_END = '\x02', '\x03'
+
+
+def rebuild_index():
+    """
+    Crea la tabla y los disparadores si faltan y reconstruye el índice desde
+    messenger_message.
+    """
+    install(connection, rebuild=True)
+
+
+def fts_query(text):
+    """
+    Convierte el texto del usuario en una consulta FTS5 segura: cada palabra va entre
+    comillas (así no se interpreta la sintaxis de FTS5) y la última admite prefijos.
+    Devuelve None si no queda ninguna palabra.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def highlight(snippet):
+    return escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+
+
+def search_messages(user, text, limit=SEARCH_LIMIT):
+    """
+    Busca en los mensajes de los hilos de los que `user` es miembro y devuelve los
+    resultados más relevantes con un fragmento resaltado (HTML ya escapado) y el enlace
+    a su posición en el hilo. Es una sola consulta: la coincidencia sale del índice
+    FTS5 y la pertenencia al hilo se comprueba con el índice de messenger_thread_users.
+    Sólo funciona en SQLite.
+    """
+    query = fts_query(text)
+    if query is None:
+        return []
+    members = Thread.users.through._meta
+    # Primero se eligen los mejores resultados y sólo después se calculan sus
+    # fragmentos; con snippet() en la misma consulta se calcularía para cada coincidencia
+    messages = Message.objects.raw(
+        f"""
+        WITH top AS (
+            SELECT m.id, f.rank
+            FROM {FTS_TABLE} f
+            JOIN {Message._meta.db_table} m ON m.id = f.rowid
+            JOIN {members.db_table} tu
+              ON tu.{Thread.users.field.m2m_column_name()} = m.thread_id
+             AND tu.{Thread.users.field.m2m_reverse_name()} = %s
+            WHERE {FTS_TABLE} MATCH %s
+            ORDER BY f.rank
+            LIMIT %s
+        )
+        SELECT m.id, m.thread_id, m.user_id, m.created, u.username AS username,
+               snippet({FTS_TABLE}, 0, %s, %s, '…', %s) AS snippet
+        FROM {FTS_TABLE} f
+        JOIN top ON top.id = f.rowid
+        JOIN {Message._meta.db_table} m ON m.id = f.rowid
+        JOIN {User._meta.db_table} u ON u.id = m.user_id
+        WHERE {FTS_TABLE} MATCH %s
+        ORDER BY top.rank
+        """,
+        [user.pk, query, limit, MARK_START, MARK_END, SNIPPET_TOKENS, query],
+    )
+    return [{
+        'id': message.pk,
+        'thread': message.thread_id,
+        'user': message.username,
+        'created': message.created,
+        'snippet': highlight(message.snippet),
+        'url': f"{reverse('messenger:detail', args=[message.thread_id])}?message={message.pk}#message-{message.pk}",
+    } for message in messages]
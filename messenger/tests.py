@@ -1,5 +1,18 @@
+import asyncio
+import json
+from datetime import timedelta
+from io import StringIO
+from django.apps import apps
+from django.core.management import call_command
 from django.test import TestCase
-from .models import Message, Thread
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.db.models.signals import post_migrate
+from django.urls import reverse
+from django.utils import timezone
+from .models import Message, MessageArchive, ReadPointer, Thread
+from .events import broker, stream_events
+from .search import search_messages
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
@@ -27,9 +40,9 @@ class ThreadTestCase(TestCase):
 
     def test_add_messages_to_thread(self):
         self.thread.users.add(self.user1, self.user2)
-        message1 = Message.objects.create(user=self.user1, content="Hola mundo")
-        message2 = Message.objects.create(user=self.user2, content="Hola loquer")
-        self.thread.messages.add(message1, message2)
+        message1 = Message(user=self.user1, content="Hola mundo")
+        message2 = Message(user=self.user2, content="Hola loquer")
+        self.thread.add_messages(message1, message2)
         self.assertEqual(len(self.thread.messages.all()), 2)
 
         for message in self.thread.messages.all():
@@ -37,20 +50,660 @@ class ThreadTestCase(TestCase):
 
     def test_add_message_from_user_not_in_thread(self):
         self.thread.users.add(self.user1, self.user2)
-        message1 = Message.objects.create(user=self.user1, content="Hola mundo")
-        message2 = Message.objects.create(user=self.user2, content="Hola")
-        message3 = Message.objects.create(user=self.user3, content="Soy un espía") 
-        self.thread.messages.add(message1, message2, message3)
+        message1 = Message(user=self.user1, content="Hola mundo")
+        message2 = Message(user=self.user2, content="Hola")
+        message3 = Message(user=self.user3, content="Soy un espía") 
+        self.thread.add_messages(message1, message2, message3)
         self.assertEqual(len(self.thread.messages.all()), 2)   
 
+    def test_add_many_messages_constant_queries(self):
+        self.thread.users.add(self.user1, self.user2)
+        messages = [Message(user=(self.user1, self.user2, self.user3)[i % 3], content=f"Mensaje {i}") for i in range(1000)]
+        # Miembros, los INSERT de bulk_create (por lotes de SQLite) y el contador del hilo
+        with CaptureQueriesContext(connection) as queries:
+            self.thread.add_messages(*messages)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(queries) - len(inserts), 4)  # SAVEPOINT, miembros, UPDATE, RELEASE
+        self.assertEqual(self.thread.messages.count(), 667)
+
+    def test_add_message_touches_updated_once(self):
+        self.thread.users.add(self.user1)
+        updated = self.thread.updated
+        spy = Message(user=self.user3, content="Soy un espía")
+        self.thread.add_messages(spy)
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.updated, updated)
+
+        self.thread.add_messages(Message(user=self.user1, content="Hola"))
+        self.thread.refresh_from_db()
+        self.assertGreater(self.thread.updated, updated)
+
+    def test_message_thread_foreign_key(self):
+        self.thread.users.add(self.user1, self.user2)
+        message = Message.objects.create(thread=self.thread, user=self.user1, content="Directo")
+        self.assertEqual(list(self.thread.messages.all()), [message])
+        self.assertEqual(Message.objects.filter(thread=self.thread).count(), 1)
+
     def test_find_thread_with_custom_manager(self):
         self.thread.users.add(self.user1, self.user2)
         thread = Thread.objects.find(self.user1, self.user2)
         self.assertEqual(self.thread, thread)
 
+    def test_find_thread_single_query(self):
+        self.thread.users.add(self.user1, self.user2)
+        self.thread.refresh_from_db()
+        self.assertEqual((self.thread.user_low, self.thread.user_high), (self.user1, self.user2))
+        with self.assertNumQueries(1):
+            self.assertEqual(Thread.objects.find(self.user2, self.user1), self.thread)
+
+    def test_find_or_create_never_duplicates(self):
+        thread1 = Thread.objects.find_or_create(self.user2, self.user3)
+        thread2 = Thread.objects.find_or_create(self.user3, self.user2)
+        self.assertEqual(thread1, thread2)
+        self.assertEqual(Thread.objects.filter(users=self.user2).filter(users=self.user3).count(), 1)
+        self.assertEqual(set(thread1.users.all()), {self.user2, self.user3})
+
+    def test_group_thread_has_no_user_pair(self):
+        self.thread.users.add(self.user1, self.user2, self.user3)
+        self.thread.refresh_from_db()
+        self.assertIsNone(self.thread.user_low)
+        self.assertIsNone(Thread.objects.find(self.user1, self.user2))
+
     def test_find_or_create_thread_with_custom_manager(self):
         self.thread.users.add(self.user1, self.user2)
         thread = Thread.objects.find_or_create(self.user1, self.user2)
         self.assertEqual(self.thread, thread)
         thread = Thread.objects.find_or_create(self.user1, self.user3)
         self.assertIsNotNone(thread)
+
+    def test_no_thread_with_oneself(self):
+        with self.assertRaises(ValueError):
+            Thread.objects.find_or_create(self.user1, self.user1)
+        self.client.force_login(self.user1)
+        for _ in range(2):
+            response = self.client.get(reverse('messenger:start', args=[self.user1.username]))
+            self.assertEqual(response.status_code, 404)
+        self.assertFalse(Thread.objects.filter(users=self.user1).exists())
+
+
+class InboxTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user('user1', 'user1@test.com', 'test1234')
+        self.others = [User.objects.create_user(f'other{i}', f'other{i}@test.com', 'test1234') for i in range(5)]
+
+    def crear_hilo(self, other, *contenidos):
+        thread = Thread.objects.find_or_create(self.user1, other)
+        for user, content in contenidos:
+            thread.add_messages(Message(user=user, content=content))
+        return thread
+
+    def test_inbox_datos_de_cada_hilo(self):
+        other = self.others[0]
+        thread = self.crear_hilo(other, (self.user1, "Hola"), (other, "Qué tal"), (other, "¿Estás?"))
+        # Un hilo sin mensajes no aparece en la bandeja
+        Thread.objects.find_or_create(self.user1, self.others[1])
+
+        inbox = Thread.objects.inbox(self.user1)
+        self.assertEqual([t.pk for t in inbox], [thread.pk])
+        self.assertEqual(inbox[0].other, other)
+        self.assertIsNone(inbox[0].avatar_url)
+        self.assertEqual(inbox[0].last_message_snippet, "¿Estás?")
+        self.assertEqual(inbox[0].unread_count, 2)
+
+        # Al marcar el hilo como leído los mensajes dejan de contar como no leídos
+        thread.mark_read(self.user1)
+        thread.add_messages(Message(user=self.user1, content="Sí"))
+        self.assertEqual(Thread.objects.inbox(self.user1)[0].unread_count, 0)
+        self.assertEqual(Thread.objects.inbox(other)[0].unread_count, 2)
+
+    def test_inbox_numero_constante_de_consultas(self):
+        self.crear_hilo(self.others[0], (self.others[0], "Hola"))
+        with self.assertNumQueries(2):
+            Thread.objects.inbox(self.user1)
+
+        for other in self.others[1:]:
+            self.crear_hilo(other, (other, "Hola"), (self.user1, "Buenas"))
+        with self.assertNumQueries(2):
+            inbox = Thread.objects.inbox(self.user1)
+        self.assertEqual(len(inbox), 5)
+
+    def test_inbox_ordenada_por_ultimo_mensaje(self):
+        antiguo = self.crear_hilo(self.others[0], (self.others[0], "Hola"))
+        nuevo = self.crear_hilo(self.others[1], (self.others[1], "Hola"))
+        self.assertEqual([t.pk for t in Thread.objects.inbox(self.user1)], [nuevo.pk, antiguo.pk])
+
+        antiguo.add_messages(Message(user=self.user1, content="Te respondo"))
+        inbox = Thread.objects.inbox(self.user1)
+        self.assertEqual([t.pk for t in inbox], [antiguo.pk, nuevo.pk])
+        self.assertEqual(inbox[0].last_message_snippet, "Te respondo")
+
+    def test_campos_desnormalizados(self):
+        thread = self.crear_hilo(self.others[0], (self.others[0], "Uno"), (self.user1, "Dos"))
+        ultimo = Message.objects.create(thread=thread, user=self.user1, content="Tres")
+        thread.refresh_from_db()
+        self.assertEqual(thread.message_count, 3)
+        self.assertEqual(thread.last_message, ultimo)
+        self.assertEqual(thread.last_message_at, ultimo.created)
+
+        # Un mensaje más antiguo no desplaza al último
+        otro = self.crear_hilo(self.others[1], (self.user1, "Antiguo"))
+        antiguo = otro.messages.get()
+        Message.objects.filter(pk=antiguo.pk).update(created=ultimo.created - timedelta(days=1))
+        antiguo.refresh_from_db()
+        thread.add_messages(antiguo)
+        thread.refresh_from_db()
+        self.assertEqual(thread.last_message, ultimo)
+        self.assertEqual(thread.message_count, 4)
+        # El hilo de origen no se queda con el mensaje movido como último
+        otro.refresh_from_db()
+        self.assertEqual((otro.message_count, otro.last_message, otro.last_message_at), (0, None, None))
+
+    def test_repair_threads(self):
+        thread = self.crear_hilo(self.others[0], (self.others[0], "Uno"))
+        # bulk_create no mantiene los campos desnormalizados
+        Message.objects.bulk_create([Message(thread=thread, user=self.user1, content=f"M{i}") for i in range(5)])
+        vacio = Thread.objects.find_or_create(self.user1, self.others[1])
+        Thread.objects.filter(pk=vacio.pk).update(message_count=7)
+
+        out = StringIO()
+        call_command('repair_threads', stdout=out)
+        self.assertIn("Recalculados 2 hilos", out.getvalue())
+        thread.refresh_from_db()
+        vacio.refresh_from_db()
+        self.assertEqual(thread.message_count, 6)
+        self.assertEqual(thread.last_message, thread.messages.order_by('-created', '-pk').first())
+        self.assertEqual((vacio.message_count, vacio.last_message, vacio.last_message_at), (0, None, None))
+
+    def test_thread_list_view_numero_constante_de_consultas(self):
+        self.client.login(username='user1', password='test1234')
+        self.crear_hilo(self.others[0], (self.others[0], "Hola"))
+        with CaptureQueriesContext(connection) as un_hilo:
+            self.client.get(reverse('messenger:list'))
+
+        for other in self.others[1:]:
+            self.crear_hilo(other, (other, "Hola"))
+        with CaptureQueriesContext(connection) as cinco_hilos:
+            response = self.client.get(reverse('messenger:list'))
+        self.assertEqual(len(un_hilo), len(cinco_hilos))
+        self.assertContains(response, "other4")
+
+
+
+class UnreadTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user('user1', 'user1@test.com', 'test1234')
+        self.user2 = User.objects.create_user('user2', 'user2@test.com', 'test1234')
+        self.user3 = User.objects.create_user('user3', 'user3@test.com', 'test1234')
+        self.thread = Thread.objects.find_or_create(self.user1, self.user2)
+        self.other_thread = Thread.objects.find_or_create(self.user1, self.user3)
+
+    def send(self, thread, user, content="Hola"):
+        message = Message(user=user, content=content)
+        with self.captureOnCommitCallbacks(execute=True):
+            thread.add_messages(message)
+        return message
+
+    def test_unread_counts_single_query(self):
+        self.send(self.thread, self.user2)
+        last = self.send(self.thread, self.user2)
+        self.send(self.thread, self.user1)
+        self.send(self.other_thread, self.user3)
+        with self.assertNumQueries(1):
+            counts = Thread.objects.unread_counts(self.user1)
+        self.assertEqual(counts, {self.thread.pk: 2, self.other_thread.pk: 1})
+
+        self.thread.mark_read(self.user1, last.pk)
+        self.assertEqual(Thread.objects.unread_counts(self.user1), {self.other_thread.pk: 1})
+        self.assertEqual(Thread.objects.unread_counts(self.user2), {self.thread.pk: 1})
+
+    def test_mark_read_never_moves_back(self):
+        first = self.send(self.thread, self.user2)
+        second = self.send(self.thread, self.user2)
+        self.assertTrue(self.thread.mark_read(self.user1))
+        self.assertFalse(self.thread.mark_read(self.user1, first.pk))
+        pointer = ReadPointer.objects.get(thread=self.thread, user=self.user1)
+        self.assertEqual(pointer.last_read_id, second.pk)
+
+    def test_mark_read_cannot_skip_future_messages(self):
+        last = self.send(self.thread, self.user2)
+        self.client.login(username='user1', password='test1234')
+        self.client.post(reverse('messenger:read', args=[self.thread.pk]), {'message': '999999999'})
+        pointer = ReadPointer.objects.get(thread=self.thread, user=self.user1)
+        self.assertEqual(pointer.last_read_id, last.pk)
+        self.send(self.thread, self.user2)
+        self.assertEqual(Thread.objects.unread_counts(self.user1), {self.thread.pk: 1})
+
+    def test_detail_marks_thread_as_read(self):
+        self.send(self.thread, self.user2)
+        self.client.login(username='user1', password='test1234')
+        self.client.get(reverse('messenger:detail', args=[self.thread.pk]))
+        self.assertEqual(Thread.objects.unread_counts(self.user1), {})
+
+    def test_unread_endpoint_etag(self):
+        self.send(self.thread, self.user2)
+        self.client.login(username='user1', password='test1234')
+        url = reverse('messenger:unread')
+        response = self.client.get(url)
+        self.assertEqual(response.json(), {'total': 1, 'threads': {str(self.thread.pk): 1}})
+        etag = response['ETag']
+
+        # Sin novedades: 304 sin consultar los mensajes (sólo sesión y usuario)
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # Un mensaje nuevo cambia el ETag
+        self.send(self.other_thread, self.user3)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total'], 2)
+
+        # Marcar como leído también
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('messenger:read', args=[self.other_thread.pk]))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.json(), {'total': 1, 'threads': {str(self.thread.pk): 1}})
+
+    def test_mark_read_endpoint_requires_membership(self):
+        self.client.login(username='user2', password='test1234')
+        response = self.client.post(reverse('messenger:read', args=[self.other_thread.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+
+class SendMessagesTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user('user1', 'user1@test.com', 'test1234')
+        self.user2 = User.objects.create_user('user2', 'user2@test.com', 'test1234')
+        self.user3 = User.objects.create_user('user3', 'user3@test.com', 'test1234')
+        self.thread = Thread.objects.find_or_create(self.user1, self.user2)
+        self.url = reverse('messenger:add', args=[self.thread.pk])
+        self.client.login(username='user1', password='test1234')
+
+    def post(self, data, **extra):
+        return self.client.post(self.url, json.dumps(data), content_type='application/json', **extra)
+
+    def test_send_returns_id_and_first(self):
+        response = self.post({'content': "Hola"})
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertTrue(data['first'])
+        message = Message.objects.get(pk=data['messages'][0]['id'])
+        self.assertEqual(message.thread, self.thread)
+        self.assertEqual(data['messages'][0]['created'], message.created.isoformat())
+
+        self.assertFalse(self.post({'content': "Otra vez"}).json()['first'])
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.message_count, 2)
+
+    def test_send_does_not_count_messages(self):
+        self.post({'content': "Hola"})
+        with CaptureQueriesContext(connection) as queries:
+            self.post({'messages': ["Uno", "Dos", "Tres"]})
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql']])
+        self.assertEqual(self.thread.messages.count(), 4)
+
+    def test_retry_with_same_key_is_not_duplicated(self):
+        first = self.post({'messages': ["Uno", "Dos"]}, HTTP_IDEMPOTENCY_KEY='abc')
+        retry = self.post({'messages': ["Uno", "Dos"]}, HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(retry.status_code, 200)
+        self.assertTrue(retry.json()['duplicate'])
+        self.assertTrue(retry.json()['first'])
+        self.assertEqual(retry.json()['messages'], first.json()['messages'])
+        self.assertEqual(self.thread.messages.count(), 2)
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.message_count, 2)
+
+    def test_same_key_in_another_thread_is_a_conflict(self):
+        self.assertEqual(self.post({'content': "Uno"}, HTTP_IDEMPOTENCY_KEY='abc').status_code, 201)
+        other = Thread.objects.find_or_create(self.user1, self.user3)
+        response = self.client.post(reverse('messenger:add', args=[other.pk]), json.dumps({'content': "Dos"}),
+                                    content_type='application/json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(response.json()['created'])
+        self.assertFalse(other.messages.exists())
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post({'content': "  "}).status_code, 400)
+        self.assertEqual(self.post({'messages': ["x"] * 11}).status_code, 400)
+        self.assertEqual(self.post({'content': "x"}, HTTP_IDEMPOTENCY_KEY='k' * 65).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'content': "Hola"}).status_code, 405)
+        self.assertFalse(Message.objects.exists())
+
+    def test_send_requires_membership(self):
+        self.client.login(username='user3', password='test1234')
+        self.assertEqual(self.post({'content': "Soy un espía"}).status_code, 404)
+
+    def test_message_count_follows_add_and_create(self):
+        self.thread.add_messages(Message(user=self.user1, content="Uno"))
+        Message.objects.create(thread=self.thread, user=self.user2, content="Dos")
+        # Volver a añadir un mensaje que ya está en el hilo no lo cuenta dos veces
+        self.thread.add_messages(*self.thread.messages.all())
+        self.thread.refresh_from_db()
+        self.assertEqual(self.thread.message_count, 2)
+
+
+
+class MessageSearchTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user('user1', 'user1@test.com', 'test1234')
+        self.user2 = User.objects.create_user('user2', 'user2@test.com', 'test1234')
+        self.user3 = User.objects.create_user('user3', 'user3@test.com', 'test1234')
+        self.thread = Thread.objects.find_or_create(self.user1, self.user2)
+        self.other_thread = Thread.objects.find_or_create(self.user2, self.user3)
+        self.reunion = Message.objects.create(thread=self.thread, user=self.user2, content="La reunión es el <b>martes</b>")
+        Message.objects.create(thread=self.other_thread, user=self.user3, content="Reunión secreta")
+
+    def test_search_only_in_member_threads(self):
+        with self.assertNumQueries(1):
+            results = search_messages(self.user1, "reunion")
+        self.assertEqual([r['id'] for r in results], [self.reunion.pk])
+        self.assertEqual(len(search_messages(self.user2, "reunión")), 2)
+        self.assertEqual(search_messages(self.user3, "martes"), [])
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        result = search_messages(self.user1, "mar")[0]
+        self.assertIn('&lt;b&gt;<mark>martes</mark>&lt;/b&gt;', result['snippet'])
+        self.assertEqual(result['user'], 'user2')
+        self.assertEqual(result['created'], self.reunion.created)
+        self.assertTrue(result['url'].endswith(f'?message={self.reunion.pk}#message-{self.reunion.pk}'))
+
+    def test_fts_syntax_is_not_interpreted(self):
+        self.assertEqual(search_messages(self.user1, '" OR ( NEAR'), [])
+        self.assertEqual(search_messages(self.user1, "  "), [])
+
+    def test_index_follows_create_update_and_delete(self):
+        Message.objects.bulk_create([Message(thread=self.thread, user=self.user1, content="Llevo el proyector")])
+        self.assertEqual(len(search_messages(self.user1, "proyector")), 1)
+        Message.objects.filter(content="Llevo el proyector").update(content="Llevo la pizarra")
+        self.assertEqual(search_messages(self.user1, "proyector"), [])
+        self.assertEqual(len(search_messages(self.user1, "pizarra")), 1)
+        self.reunion.delete()
+        self.assertEqual(search_messages(self.user1, "martes"), [])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM messenger_message_fts")
+            cursor.execute("DROP TRIGGER messenger_message_fts_insert")
+        out = StringIO()
+        call_command('rebuild_message_index', stdout=out)
+        self.assertIn("2 mensajes", out.getvalue())
+        self.assertEqual(len(search_messages(self.user1, "martes")), 1)
+        # Vuelve a crear los disparadores que faltan
+        Message.objects.create(thread=self.thread, user=self.user1, content="Confirmado")
+        self.assertEqual(len(search_messages(self.user1, "confirmado")), 1)
+
+    def test_post_migrate_restores_triggers(self):
+        # Lo que pasa cuando una migración rehace la tabla de mensajes en SQLite
+        with connection.cursor() as cursor:
+            for trigger in ('insert', 'delete', 'update'):
+                cursor.execute(f"DROP TRIGGER messenger_message_fts_{trigger}")
+        app_config = apps.get_app_config('messenger')
+        post_migrate.send(sender=app_config, app_config=app_config, verbosity=0, interactive=False,
+                          using='default', apps=apps, plan=[])
+        Message.objects.create(thread=self.thread, user=self.user1, content="Confirmado")
+        self.assertEqual(len(search_messages(self.user1, "confirmado")), 1)
+
+    def test_search_endpoint_and_jump_to_message(self):
+        later = Message.objects.create(thread=self.thread, user=self.user1, content="Vale")
+        self.client.login(username='user1', password='test1234')
+        results = self.client.get(reverse('messenger:search'), {'q': 'martes'}).json()['results']
+        self.assertEqual(len(results), 1)
+
+        response = self.client.get(results[0]['url'])
+        self.assertEqual(response.context['target_message'], self.reunion)
+        self.assertEqual(response.context['thread_messages'][-1], self.reunion)
+        self.assertNotIn(later, response.context['thread_messages'])
+        self.assertContains(response, "Ir a los mensajes más recientes")
+
+
+
+class BroadcastTestCase(TestCase):
+    def setUp(self):
+        self.boss = User.objects.create_user('boss', 'boss@test.com', 'test1234', departamento='Sistemas', is_staff=True)
+        self.team = [
+            User.objects.create_user(f'tec{i}', f'tec{i}@test.com', 'test1234', departamento='Sistemas') for i in range(5)
+        ]
+        self.other = User.objects.create_user('ana', 'ana@test.com', 'test1234', departamento='Ventas')
+        User.objects.create_user('baja', 'baja@test.com', 'test1234', departamento='Sistemas', is_active=False)
+
+    def test_broadcast_reuses_and_creates_threads(self):
+        existing = Thread.objects.find_or_create(self.boss, self.team[0])
+        existing.add_messages(Message(user=self.team[0], content="Hola jefe"))
+
+        self.assertEqual(Thread.objects.broadcast(self.boss, 'Sistemas', "Corte de red a las 15:00"), 5)
+        self.assertEqual(Thread.objects.filter(users=self.boss).count(), 5)
+        for user in self.team:
+            thread = Thread.objects.find(self.boss, user)
+            self.assertEqual(set(thread.users.all()), {self.boss, user})
+            self.assertEqual(thread.last_message.content, "Corte de red a las 15:00")
+            self.assertEqual(thread.last_message_at, thread.last_message.created)
+        existing.refresh_from_db()
+        self.assertEqual(existing.message_count, 2)
+        self.assertEqual(Thread.objects.unread_counts(self.team[1]), {Thread.objects.find(self.boss, self.team[1]).pk: 1})
+        self.assertFalse(Thread.objects.filter(users=self.other).exists())
+
+    def test_broadcast_constant_queries(self):
+        with CaptureQueriesContext(connection) as small:
+            Thread.objects.broadcast(self.boss, 'Sistemas', "Aviso")
+        User.objects.bulk_create([
+            User(username=f'sop{i}', email=f'sop{i}@test.com', departamento='Soporte') for i in range(50)
+        ])
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(Thread.objects.broadcast(self.boss, 'Soporte', "Otro aviso"), 50)
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(Message.objects.filter(user=self.boss).count(), 55)
+
+    def test_broadcast_view_requires_staff(self):
+        self.client.login(username='tec0', password='test1234')
+        self.assertEqual(self.client.get(reverse('messenger:broadcast')).status_code, 302)
+
+        self.client.login(username='boss', password='test1234')
+        response = self.client.post(reverse('messenger:broadcast'), {'department': 'Sistemas', 'content': "Aviso"})
+        self.assertRedirects(response, reverse('messenger:broadcast') + '?sent=5')
+        self.assertEqual(Message.objects.filter(user=self.boss).count(), 5)
+
+
+class ThreadMessagesPaginationTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user('user1', 'user1@test.com', 'test1234')
+        self.user2 = User.objects.create_user('user2', 'user2@test.com', 'test1234')
+        self.thread = Thread.objects.find_or_create(self.user1, self.user2)
+        self.messages = Message.objects.bulk_create([
+            Message(thread=self.thread, user=(self.user1, self.user2)[i % 2], content=f"Mensaje {i}") for i in range(75)
+        ])
+        self.client.login(username='user1', password='test1234')
+
+    def test_detail_shows_latest_messages(self):
+        response = self.client.get(reverse('messenger:detail', args=[self.thread.pk]))
+        contents = [message.content for message in response.context['thread_messages']]
+        self.assertEqual(contents, [f"Mensaje {i}" for i in range(45, 75)])
+        self.assertIsNotNone(response.context['next_cursor'])
+
+    def test_cursor_walks_whole_history(self):
+        _, cursor = self.thread.messages_page()
+        contents = []
+        while cursor:
+            # Sesión, usuario, comprobación de miembro y la página de mensajes
+            with self.assertNumQueries(4):
+                response = self.client.get(reverse('messenger:messages', args=[self.thread.pk]), {'cursor': cursor})
+            data = response.json()
+            contents = [message['content'] for message in data['messages']] + contents
+            cursor = data['next_cursor']
+        self.assertEqual(contents, [f"Mensaje {i}" for i in range(0, 45)])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('messenger:messages', args=[self.thread.pk]), {'cursor': 'nada'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_messages_endpoint_requires_membership(self):
+        User.objects.create_user('user3', 'user3@test.com', 'test1234')
+        self.client.login(username='user3', password='test1234')
+        response = self.client.get(reverse('messenger:messages', args=[self.thread.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+
+class CompactMessagesTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user('user1', 'user1@test.com', 'test1234')
+        self.user2 = User.objects.create_user('user2', 'user2@test.com', 'test1234')
+        self.thread = Thread.objects.find_or_create(self.user1, self.user2)
+        now = timezone.now()
+        for i in range(75):
+            message = Message.objects.create(thread=self.thread, user=(self.user1, self.user2)[i % 2], content=f"Mensaje {i}")
+            Message.objects.filter(pk=message.pk).update(created=now - timedelta(days=75 - i, hours=-12))
+        Thread.objects.recompute_message_fields()
+        self.thread.refresh_from_db()
+
+    def compact(self, **options):
+        out = StringIO()
+        call_command('compact_messages', stdout=out, **options)
+        self.thread.refresh_from_db()
+        return out.getvalue()
+
+    def test_compacts_old_messages_in_batches(self):
+        out = self.compact(days=30, batch_size=20)
+        self.assertIn("Archivados 45 mensajes", out)
+        self.assertEqual(self.thread.messages.count(), 30)
+        self.assertEqual(list(self.thread.archives.values_list('message_count', flat=True)), [20, 20, 5])
+        self.assertEqual((self.thread.message_count, self.thread.archived_count), (75, 45))
+        # Volver a ejecutarlo no hace nada
+        self.assertIn("Archivados 0 mensajes", self.compact(days=30))
+
+        # El contador sobrevive a repair_threads
+        Thread.objects.recompute_message_fields()
+        self.thread.refresh_from_db()
+        self.assertEqual((self.thread.message_count, self.thread.archived_count), (75, 45))
+
+    def test_last_message_is_never_archived(self):
+        self.compact(days=1, batch_size=50)
+        self.assertEqual(list(self.thread.messages.all()), [self.thread.last_message])
+        self.assertEqual(Thread.objects.inbox(self.user1)[0].last_message_snippet, "Mensaje 74")
+
+    def test_history_reads_archived_messages(self):
+        self.compact(days=30, batch_size=20)
+        self.client.login(username='user1', password='test1234')
+        response = self.client.get(reverse('messenger:detail', args=[self.thread.pk]))
+        contents = [message.content for message in response.context['thread_messages']]
+        self.assertEqual(contents, [f"Mensaje {i}" for i in range(45, 75)])
+
+        cursor = response.context['next_cursor']
+        contents = []
+        while cursor:
+            data = self.client.get(reverse('messenger:messages', args=[self.thread.pk]), {'cursor': cursor}).json()
+            contents = [message['content'] for message in data['messages']] + contents
+            cursor = data['next_cursor']
+        self.assertEqual(contents, [f"Mensaje {i}" for i in range(0, 45)])
+        self.assertEqual(data['messages'][0]['user'], 'user1')
+
+    def test_archive_blob_is_compressed(self):
+        self.compact(days=30, batch_size=50)
+        archive = MessageArchive.objects.get()
+        messages = archive.messages()
+        self.assertEqual([m.content for m in messages], [f"Mensaje {i}" for i in range(45)])
+        self.assertTrue(all(m.archived for m in messages))
+        self.assertLess(len(archive.data), sum(len(m.content) for m in messages))
+
+
+class MessageStreamTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user('user1', 'user1@test.com', 'test1234')
+        self.user2 = User.objects.create_user('user2', 'user2@test.com', 'test1234')
+        self.user3 = User.objects.create_user('user3', 'user3@test.com', 'test1234')
+        self.thread = Thread.objects.find_or_create(self.user1, self.user2)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def open_stream(self, user):
+        stream = stream_events(user.pk)
+        # El primer fragmento (retry) deja la conexión suscrita
+        self.assertTrue(self.loop.run_until_complete(anext(stream)).startswith('retry'))
+        self.addCleanup(self.loop.run_until_complete, stream.aclose())
+        return stream
+
+    def test_members_receive_new_messages(self):
+        stream1, stream3 = self.open_stream(self.user1), self.open_stream(self.user3)
+        message = Message(user=self.user2, content="Hola")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.thread.add_messages(message)
+
+        chunk = self.loop.run_until_complete(anext(stream1))
+        data = json.loads(chunk.split('data: ', 1)[1])
+        self.assertEqual(data['id'], message.pk)
+        self.assertEqual(data['thread'], self.thread.pk)
+        self.assertEqual(data['user'], 'user2')
+        # user3 no es miembro del hilo: sólo recibe el keepalive
+        self.assertFalse(broker.has_subscribers([self.user2.pk]))
+        stream3 = stream_events(self.user3.pk, keepalive=0.01)
+        self.loop.run_until_complete(anext(stream3))
+        self.assertEqual(self.loop.run_until_complete(anext(stream3)), ': keepalive\n\n')
+        self.loop.run_until_complete(stream3.aclose())
+
+    def test_messages_created_inside_thread_are_published(self):
+        stream = self.open_stream(self.user2)
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(thread=self.thread, user=self.user1, content="Directo")
+        chunk = self.loop.run_until_complete(anext(stream))
+        self.assertIn(f'id: {message.pk}', chunk)
+
+    def test_no_queries_without_subscribers(self):
+        message = Message(user=self.user1, content="Nadie escucha")
+        # Savepoint, miembros, INSERT, contador del hilo y release, sin buscar a quién avisar
+        with self.assertNumQueries(5):
+            self.thread.add_messages(message)
+
+    def test_closed_stream_unsubscribes(self):
+        stream = stream_events(self.user1.pk)
+        self.loop.run_until_complete(anext(stream))
+        self.assertTrue(broker.has_subscribers([self.user1.pk]))
+        self.loop.run_until_complete(stream.aclose())
+        self.assertFalse(broker.has_subscribers())
+
+    def test_stream_requires_login(self):
+        response = self.client.get(reverse('messenger:stream'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_stream_not_served_over_wsgi(self):
+        self.client.force_login(self.user1)
+        response = self.client.get(reverse('messenger:stream'))
+        self.assertEqual(response.status_code, 204)
+
+    async def test_stream_served_over_asgi(self):
+        await self.async_client.aforce_login(self.user1)
+        response = await self.async_client.get(reverse('messenger:stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b'retry'))
+        self.assertTrue(broker.has_subscribers([self.user1.pk]))
+        await response.streaming_content.aclose()
+
+    def test_idle_streams_subscribe_wait_silently_and_unsubscribe(self):
+        # Cientos de generadores stream_events abiertos sin actividad: cada uno queda
+        # suscrito una vez, no produce nada hasta que se publica un mensaje, todos lo
+        # reciben y al cerrarlos el broker se queda vacío. No mide memoria ni CPU
+        connections = 500
+        user_ids = range(10**6, 10**6 + connections)
+
+        async def scenario():
+            streams = [stream_events(user_id, keepalive=60) for user_id in user_ids]
+            for stream in streams:
+                await anext(stream)
+            subscribed = sum(len(broker._subscribers[user_id]) for user_id in user_ids)
+            waiting = [asyncio.ensure_future(anext(stream)) for stream in streams]
+            await asyncio.sleep(0.05)
+            idle = [future for future in waiting if future.done()]
+
+            broker.publish(user_ids, {'id': 1})
+            chunks = await asyncio.gather(*waiting)
+            for stream in streams:
+                await stream.aclose()
+            return subscribed, idle, chunks
+
+        subscribed, idle, chunks = self.loop.run_until_complete(scenario())
+        self.assertEqual(subscribed, connections)
+        self.assertEqual(idle, [])
+        self.assertEqual(len(chunks), connections)
+        self.assertTrue(all(chunk.startswith('id: 1\n') for chunk in chunks))
+        self.assertFalse(broker.has_subscribers())
@@ -1,9 +1,15 @@
 from django.urls import path
-from .views import ThreadList, ThreadDetail, add_message, start_thread
+from .views import Broadcast, ThreadList, ThreadDetail, add_message, mark_read, search, start_thread, stream, thread_messages, unread
 
 messenger_patterns = ([
     path('', ThreadList.as_view(), name='list'),
     path('thread/<int:pk>/', ThreadDetail.as_view(), name='detail'),
     path('thread/<int:pk>/add/', add_message, name='add'),
+    path('thread/<int:pk>/messages/', thread_messages, name='messages'),
     path('thread/start/<username>/', start_thread, name="start"),
+    path('thread/<int:pk>/read/', mark_read, name='read'),
+    path('unread/', unread, name='unread'),
+    path('search/', search, name='search'),
+    path('stream/', stream, name='stream'),
+    path('broadcast/', Broadcast.as_view(), name='broadcast'),
 ], 'messenger')
\ No newline at end of file
@@ -1,12 +1,20 @@
+import json
 from django.shortcuts import render
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
-from django.views.generic import TemplateView
+from django.views.generic import FormView, TemplateView
 from django.views.generic.detail import DetailView
-from .models import Thread, Message
+from .models import IDEMPOTENCY_KEY_LENGTH, SEND_BATCH_SIZE, Thread, Message
+from .cache import unread_version
+from .forms import BroadcastForm
+from .events import stream_events
+from .search import search_messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from django.http import Http404, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.views.decorators.http import etag, require_POST
 from django.contrib.auth import get_user_model 
 
 
@@ -14,38 +22,181 @@ User = get_user_model()
 
 
 
+class InboxMixin(object):
+    """
+    Este mixin añade al contexto la bandeja de entrada del usuario (panel izquierdo)
+    """
+    def get_context_data(self, **kwargs):
+        context = super(InboxMixin, self).get_context_data(**kwargs)
+        context['inbox'] = Thread.objects.inbox(self.request.user)
+        return context
+
 # Create your views here.
 @method_decorator(login_required, name='dispatch')
-class ThreadList(TemplateView):
+class ThreadList(InboxMixin, TemplateView):
     template_name = 'messenger/thread_list.html'
 
 @method_decorator(login_required, name='dispatch')
-class ThreadDetail(DetailView):
+class ThreadDetail(InboxMixin, DetailView):
     model = Thread
 
     def get_object(self):
         obj = super(ThreadDetail, self).get_object()
-        if self.request.user not in obj.users.all():
+        if not obj.users.filter(pk=self.request.user.pk).exists():
             raise Http404()
         return obj
-    
+
+    def get_context_data(self, **kwargs):
+        context = super(ThreadDetail, self).get_context_data(**kwargs)
+        # Desde un resultado de búsqueda (?message=<id>) la página termina en ese mensaje
+        message_id = self.request.GET.get('message', '')
+        target = self.object.messages.filter(pk=message_id).first() if message_id.isdigit() else None
+        context['target_message'] = target
+        # Sólo los últimos mensajes; los anteriores se cargan al hacer scroll hacia arriba
+        context['thread_messages'], context['next_cursor'] = self.object.messages_page(until=target)
+        # Abrir el hilo marca como leídos todos los mensajes mostrados
+        if context['thread_messages']:
+            self.object.mark_read(self.request.user, context['thread_messages'][-1].pk)
+        return context
+
+@login_required
+def thread_messages(request, pk):
+    """
+    Devuelve en JSON la página de mensajes anterior al cursor indicado.
+    """
+    thread = get_object_or_404(Thread, pk=pk, users=request.user)
+    try:
+        messages, next_cursor = thread.messages_page(request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({'error': 'Cursor no válido'}, status=400)
+    return JsonResponse({
+        'messages': [{
+            'id': message.pk,
+            # Un mensaje archivado puede ser de un usuario que ya no existe
+            'user': message.user.username if message.user else None,
+            'mine': message.user_id == request.user.pk,
+            'content': message.content,
+            'created': message.created.isoformat(),
+        } for message in messages],
+        'next_cursor': next_cursor,
+    })
+
+@login_required
+def search(request):
+    """
+    Busca texto en los mensajes de los hilos del usuario y devuelve en JSON los
+    fragmentos resaltados con el enlace a cada mensaje dentro de su hilo.
+    """
+    return JsonResponse({'results': search_messages(request.user, request.GET.get('q', ''))})
+
+@login_required
+@require_POST
+def mark_read(request, pk):
+    """
+    Avanza el puntero de lectura del usuario hasta el mensaje indicado (o hasta el final).
+    """
+    thread = get_object_or_404(Thread, pk=pk, users=request.user)
+    message_id = request.POST.get('message')
+    if message_id is not None and not message_id.isdigit():
+        return JsonResponse({'error': 'Mensaje no válido'}, status=400)
+    changed = thread.mark_read(request.user, int(message_id) if message_id else None)
+    return JsonResponse({'changed': changed})
+
+@login_required
+@etag(lambda request: str(unread_version(request.user.pk)))
+def unread(request):
+    """
+    Contadores de mensajes sin leer para sondear desde el navegador. Mientras no llegue
+    nada nuevo el ETag no cambia y se responde 304 sin consultar los mensajes.
+    """
+    counts = Thread.objects.unread_counts(request.user)
+    response = JsonResponse({
+        'total': sum(counts.values()),
+        'threads': {str(pk): count for pk, count in counts.items()},
+    })
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@login_required
+async def stream(request):
+    """
+    Flujo Server-Sent Events con los mensajes nuevos de los hilos del usuario.
+    Cada conexión abierta es sólo una corrutina esperando en su cola, por eso
+    necesita servirse por ASGI (calendary/asgi.py) en un único proceso.
+    """
+    if not isinstance(request, ASGIRequest):
+        # Por WSGI el flujo ocuparía un hilo para siempre; el 204 le dice al
+        # navegador que no vuelva a intentar la conexión
+        return HttpResponse(status=204)
+    user = await request.auser()
+    response = StreamingHttpResponse(stream_events(user.pk), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+@require_POST
 def add_message(request, pk):
-    json_response = {'created':False}
-    if request.user.is_authenticated:
-        content = request.GET.get('content', None)
-        if content:
-            thread = get_object_or_404(Thread, pk=pk)  
-            message = Message.objects.create(user=request.user, content=content)
-            thread.messages.add(message)
-            json_response['created'] = True
-            if len(thread.messages.all()) is 1:
-                json_response['first'] = True
-    else:
-        raise Http404("User is not authenticated")
-    return JsonResponse(json_response)
+    """
+    Envía uno o varios mensajes al hilo. Recibe un JSON con "content" o con una lista
+    "messages" (como mucho SEND_BATCH_SIZE) y, opcionalmente, una clave de idempotencia
+    en la cabecera Idempotency-Key o en el campo "idempotency_key". Un reintento con la
+    misma clave devuelve los mensajes ya creados; reutilizarla en otro hilo da un 409.
+    """
+    thread = get_object_or_404(Thread, pk=pk, users=request.user)
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'created': False, 'error': 'JSON no válido'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'created': False, 'error': 'JSON no válido'}, status=400)
+
+    contents = data.get('messages', [data.get('content')])
+    if (not isinstance(contents, list) or not 0 < len(contents) <= SEND_BATCH_SIZE
+            or not all(isinstance(content, str) and content.strip() for content in contents)):
+        return JsonResponse({
+            'created': False,
+            'error': f'Hay que enviar entre 1 y {SEND_BATCH_SIZE} mensajes con contenido',
+        }, status=400)
+    key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    if key is not None and (not isinstance(key, str) or len(key) > IDEMPOTENCY_KEY_LENGTH):
+        return JsonResponse({'created': False, 'error': 'Clave de idempotencia no válida'}, status=400)
+
+    try:
+        messages, first, duplicate = thread.send_messages(request.user, contents, key)
+    except ValueError as error:
+        return JsonResponse({'created': False, 'error': str(error)}, status=409)
+    return JsonResponse({
+        'created': True,
+        'first': first,
+        'duplicate': duplicate,
+        'messages': [{'id': message.pk, 'created': message.created.isoformat()} for message in messages],
+    }, status=200 if duplicate else 201)
+
+@method_decorator(staff_member_required, name='dispatch')
+class Broadcast(FormView):
+    """
+    Vista para que el personal envíe un aviso a todos los usuarios de un departamento.
+    """
+    form_class = BroadcastForm
+    template_name = 'messenger/broadcast.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['sent'] = self.request.GET.get('sent')
+        return context
+
+    def form_valid(self, form):
+        self.sent = form.save(self.request.user)
+        return super().form_valid(form)
+
+    def get_success_url(self):
+        return reverse_lazy('messenger:broadcast') + f'?sent={self.sent}'
 
 @login_required
 def start_thread(request, username):
     user = get_object_or_404(User, username=username)
+    if user.pk == request.user.pk:
+        raise Http404()
     thread = Thread.objects.find_or_create(user, request.user)
     return redirect(reverse_lazy('messenger:detail', args=[thread.pk]))
\ No newline at end of file
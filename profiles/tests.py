@@ -1,3 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+User = get_user_model()
 
 # Create your tests here.
+class ProfileListTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(f'user{i:02d}', f'user{i}@test.com', 'test1234',
+                                     departamento='IT' if i % 2 else 'Finanzas')
+            for i in range(30)
+        ]
+
+    def test_paginacion_con_consultas_constantes(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profiles:list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['is_paginated'])
+        self.assertEqual(len(response.context['profile_list']), 12)
+        # El recuento del paginador y la página con sus usuarios
+        self.assertEqual(len(queries), 2)
+
+    def test_busqueda_por_usuario_y_departamento(self):
+        response = self.client.get(reverse('profiles:list'), {'busqueda': 'USER1', 'departamento': 'it'})
+        usernames = [profile.user.username for profile in response.context['profile_list']]
+        self.assertEqual(usernames, ['user11', 'user13', 'user15', 'user17', 'user19'])
+        # La paginación conserva la búsqueda
+        response = self.client.get(reverse('profiles:list'), {'departamento': 'IT', 'page': 2})
+        self.assertContains(response, '?departamento=IT&amp;page=1')
+
+    def test_variante_json(self):
+        self.client.force_login(self.users[0])
+        response = self.client.get(reverse('profiles:list'), {'format': 'json', 'busqueda': 'user0'})
+        data = response.json()
+        # El propio usuario no aparece en el selector de conversación
+        self.assertEqual([p['username'] for p in data['results']], [f'user0{i}' for i in range(1, 10)])
+        self.assertEqual(data['results'][0]['departamento'], 'IT')
+        self.assertIsNone(data['results'][0]['avatar'])
+        self.assertFalse(data['has_next'])
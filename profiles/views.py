@@ -1,4 +1,6 @@
 from django.shortcuts import get_object_or_404
+from django.http import JsonResponse
+from django.urls import reverse
 from django.views.generic.list import ListView
 from django.views.generic.detail import DetailView
 from registration.models import Profile
@@ -8,10 +10,51 @@ from registration.models import Profile
 class ProfileListView(ListView):
     model = Profile
     template_name = 'profiles/profile_list.html'
+    paginate_by = 12 # Número de perfiles por página (cuatro filas de tres)
+
+    def get_queryset(self):
+        # El usuario viene en la misma consulta: la plantilla usa su nombre en cada fila
+        queryset = super().get_queryset().select_related('user')
+
+        # Búsqueda por el principio del nombre de usuario y por departamento. Las dos
+        # usan los índices sin distinción de mayúsculas de CustomUser
+        busqueda_query = self.request.GET.get('busqueda', '').strip()
+        departamento_query = self.request.GET.get('departamento', '').strip()
+        if busqueda_query:
+            queryset = queryset.filter(user__username__istartswith=busqueda_query)
+        if departamento_query:
+            queryset = queryset.filter(user__departamento__iexact=departamento_query)
+        if self.request.GET.get('format') == 'json' and self.request.user.is_authenticated:
+            # En el selector de conversación no tiene sentido elegirse a uno mismo
+            queryset = queryset.exclude(user=self.request.user)
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Pasamos las variables de búsqueda al contexto para que los campos no se vacíen
+        context['busqueda_query'] = self.request.GET.get('busqueda', '')
+        context['departamento_query'] = self.request.GET.get('departamento', '')
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        # Variante JSON para el selector de "nueva conversación" del messenger
+        if self.request.GET.get('format') != 'json':
+            return super().render_to_response(context, **response_kwargs)
+        page = context['page_obj']
+        return JsonResponse({
+            'results': [{
+                'username': profile.user.username,
+                'departamento': profile.user.departamento,
+                'avatar': profile.avatar_thumbnail_url,
+                'url': reverse('profiles:detail', args=[profile.user.username]),
+            } for profile in context['profile_list']],
+            'page': page.number,
+            'has_next': page.has_next(),
+        })
 
 class ProfileDetailView(DetailView):
     model = Profile
     template_name = 'profiles/profile_detail.html'
 
     def get_object(self):
-        return get_object_or_404(Profile, user__username=self.kwargs['username'])
+        return get_object_or_404(Profile.objects.select_related('user'), user__username=self.kwargs['username'])
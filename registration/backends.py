@@ -0,0 +1,29 @@
+# registration/backends.py
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from .cache import user_cache_key
+
+
+class ProfileBackend(ModelBackend):
+    """
+    ModelBackend que carga el usuario de cada petición junto con su perfil en una sola
+    consulta. Con AUTH_USER_CACHE_TIMEOUT > 0 además lo guarda en la caché durante esos
+    segundos; se invalida al guardar o borrar el usuario o su perfil (también el cambio
+    de contraseña, que cambia el hash de la sesión). Con LocMem y varios procesos los
+    demás procesos pueden ver el usuario anterior hasta que caduque.
+    """
+
+    def get_user(self, user_id):
+        timeout = settings.AUTH_USER_CACHE_TIMEOUT
+        user = cache.get(user_cache_key(user_id)) if timeout else None
+        if user is None:
+            UserModel = get_user_model()
+            try:
+                user = UserModel._default_manager.select_related('profile').get(pk=user_id)
+            except UserModel.DoesNotExist:
+                return None
+            if timeout:
+                cache.set(user_cache_key(user_id), user, timeout)
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,13 @@
+# registration/cache.py
+from django.core.cache import cache
+
+
+def user_cache_key(user_id):
+    return f'registration:user:{user_id}'
+
+
+def invalidar_usuario(user_id):
+    """
+    Borra de la caché el usuario (y su perfil) que guarda ProfileBackend.
+    """
+    cache.delete(user_cache_key(user_id))
@@ -0,0 +1,128 @@
+# registration/management/commands/provision_users.py
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.functions import Lower
+from registration.models import CustomUser, Profile
+
+REQUIRED_COLUMNS = {'username', 'email', 'password'}
+
+# Columnas opcionales que se copian tal cual al usuario
+OPTIONAL_COLUMNS = ('first_name', 'last_name', 'telefono', 'departamento',
+                    'respuesta_seguridad_1', 'respuesta_seguridad_2')
+
+# Tamaño de los lotes para las consultas con IN, por debajo del límite de variables de SQLite
+LOOKUP_BATCH_SIZE = 500
+
+
+def hash_password(password):
+    # Sin contraseña la cuenta queda sin contraseña utilizable (como set_unusable_password)
+    return make_password(password or None)
+
+
+class Command(BaseCommand):
+    help = ("Crea usuarios y sus perfiles a partir de un CSV con las columnas username, email "
+            "y password (y opcionalmente first_name, last_name, telefono, departamento, "
+            "respuesta_seguridad_1, respuesta_seguridad_2 e is_staff). Las contraseñas se "
+            "cifran en varios procesos y las filas se insertan en bloque, sin señales.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help="Ruta del fichero CSV.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Procesos para cifrar contraseñas (por defecto, uno por CPU).")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Filas por INSERT.")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("Hace falta al menos un proceso.")
+        start = time.perf_counter()
+        rows = self.read_rows(options['csv_file'])
+        rows = self.skip_invalid(rows)
+        if not rows:
+            self.stdout.write("No hay usuarios que crear.")
+            return
+
+        # PBKDF2 es lo caro: se reparte entre procesos y el orden se conserva
+        hashing = time.perf_counter()
+        chunksize = max(1, len(rows) // (options['workers'] * 4))
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            passwords = list(pool.map(hash_password, [row['password'] for row in rows], chunksize=chunksize))
+        hashing = time.perf_counter() - hashing
+
+        inserting = time.perf_counter()
+        users = [self.build_user(row, password) for row, password in zip(rows, passwords)]
+        with transaction.atomic():
+            # bulk_create no lanza post_save, así que los perfiles se crean aquí en bloque
+            # en lugar de con un get_or_create por usuario en ensure_profile_exists
+            users = CustomUser.objects.bulk_create(users, batch_size=options['batch_size'])
+            Profile.objects.bulk_create([Profile(user=user) for user in users], batch_size=options['batch_size'])
+        inserting = time.perf_counter() - inserting
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Creados {len(users)} usuarios en {elapsed:.1f}s ({len(users) / elapsed:.0f} usuarios/s; "
+            f"cifrado {hashing:.1f}s con {options['workers']} procesos, inserción {inserting:.1f}s)."
+        ))
+
+    def read_rows(self, path):
+        try:
+            with open(path, newline='', encoding='utf-8-sig') as csv_file:
+                reader = csv.DictReader(csv_file)
+                missing = REQUIRED_COLUMNS - set(reader.fieldnames or ())
+                if missing:
+                    raise CommandError(f"Faltan columnas en el CSV: {', '.join(sorted(missing))}.")
+                return [{key: (value or '').strip() for key, value in row.items() if key} for row in reader]
+        except OSError as error:
+            raise CommandError(f"No se puede leer {path}: {error}")
+
+    def skip_invalid(self, rows):
+        """
+        Descarta (y avisa de) las filas sin usuario o email, las repetidas en el propio CSV
+        y las que ya existen en la base de datos, que se consulta por lotes.
+        """
+        valid, usernames, emails = [], set(), set()
+        for line, row in enumerate(rows, start=2):
+            row['username'] = CustomUser.normalize_username(row['username'])
+            row['email'] = CustomUser.objects.normalize_email(row['email'])
+            if not row['username'] or not row['email']:
+                self.stderr.write(f"Línea {line}: falta el usuario o el email.")
+            elif row['username'] in usernames or row['email'].lower() in emails:
+                self.stderr.write(f"Línea {line}: {row['username']} está repetido en el CSV.")
+            else:
+                usernames.add(row['username'])
+                emails.add(row['email'].lower())
+                row['line'] = line
+                valid.append(row)
+
+        taken_usernames, taken_emails = set(), set()
+        for i in range(0, len(valid), LOOKUP_BATCH_SIZE):
+            batch = valid[i:i + LOOKUP_BATCH_SIZE]
+            taken_usernames.update(CustomUser.objects.filter(
+                username__in=[row['username'] for row in batch]
+            ).values_list('username', flat=True))
+            # El email es UNIQUE pero distingue mayúsculas: se compara en minúsculas
+            taken_emails.update(CustomUser.objects.annotate(email_lower=Lower('email')).filter(
+                email_lower__in=[row['email'].lower() for row in batch]
+            ).values_list('email_lower', flat=True))
+
+        rows = []
+        for row in valid:
+            if row['username'] in taken_usernames or row['email'].lower() in taken_emails:
+                self.stderr.write(f"Línea {row['line']}: {row['username']} ya existe.")
+            else:
+                rows.append(row)
+        return rows
+
+    def build_user(self, row, password):
+        return CustomUser(
+            username=row['username'],
+            email=row['email'],
+            password=password,
+            is_staff=row.get('is_staff', '').lower() in ('1', 'true', 'sí', 'si', 'yes'),
+            **{column: row.get(column, '') for column in OPTIONAL_COLUMNS},
+        )
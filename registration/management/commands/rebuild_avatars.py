@@ -0,0 +1,63 @@
+# registration/management/commands/rebuild_avatars.py
+import os
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from registration.models import Profile
+from registration.thumbnails import thumbnail_name, write_thumbnail
+
+
+def build(avatar_name, force=False):
+    """
+    Trabajo de cada proceso: sólo ficheros, nada de base de datos. Devuelve el nombre
+    de la miniatura o el error para que el proceso principal lo informe.
+    """
+    try:
+        return write_thumbnail(avatar_name, force=force), None
+    except Exception as error:
+        return None, str(error)
+
+
+class Command(BaseCommand):
+    help = ("Genera las miniaturas de los avatares que no la tienen (o de todos con --force) "
+            "repartiendo el trabajo de Pillow entre varios procesos.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Número de procesos (por defecto, uno por CPU).")
+        parser.add_argument('--force', action='store_true',
+                            help="Regenera también las miniaturas que ya están al día.")
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help="Perfiles que se actualizan en cada consulta.")
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError("Hace falta al menos un proceso.")
+
+        profiles = Profile.objects.exclude(avatar='').exclude(avatar__isnull=True).only('avatar', 'avatar_thumbnail')
+        if not options['force']:
+            profiles = [p for p in profiles if p.avatar_thumbnail.name != thumbnail_name(p.avatar.name)]
+        profiles = list(profiles)
+
+        # Los perfiles con la misma imagen comparten avatar y miniatura: se genera una vez
+        avatars = sorted({p.avatar.name for p in profiles})
+        thumbnails, failed = {}, 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            results = pool.map(build, avatars, [options['force']] * len(avatars), chunksize=8)
+            for avatar, (name, error) in zip(avatars, results):
+                if error:
+                    failed += 1
+                    self.stderr.write(f"{avatar}: {error}")
+                else:
+                    thumbnails[avatar] = name
+
+        updated = []
+        for profile in profiles:
+            if profile.avatar.name in thumbnails:
+                profile.avatar_thumbnail.name = thumbnails[profile.avatar.name]
+                updated.append(profile)
+
+        # Un UPDATE por lote en lugar de save(), que volvería a encargar la miniatura
+        Profile.objects.bulk_update(updated, ['avatar_thumbnail'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Generadas {len(thumbnails)} miniaturas para {len(updated)} perfiles ({failed} errores)."
+        ))
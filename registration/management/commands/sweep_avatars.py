@@ -0,0 +1,44 @@
+# registration/management/commands/sweep_avatars.py
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from registration.models import Profile
+from registration.storage import avatar_storage
+from registration.thumbnails import THUMBNAIL_DIR
+
+
+class Command(BaseCommand):
+    help = ("Borra los avatares y miniaturas que ya no usa ningún perfil. Los ficheros "
+            "recientes se respetan para no borrar una subida que aún no se ha guardado.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=24,
+                            help="Sólo se borran los ficheros con más horas que éstas.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Lista los ficheros que se borrarían sin borrarlos.")
+
+    def handle(self, *args, **options):
+        if options['min_age'] < 1:
+            raise CommandError("La antigüedad mínima debe ser de al menos una hora.")
+        cutoff = timezone.now() - timedelta(hours=options['min_age'])
+
+        in_use = set()
+        for avatar, thumbnail in Profile.objects.values_list('avatar', 'avatar_thumbnail').iterator():
+            in_use.update(name for name in (avatar, thumbnail) if name)
+
+        removed = 0
+        for directory in ('profiles', THUMBNAIL_DIR):
+            if not avatar_storage.exists(directory):
+                continue
+            for filename in avatar_storage.listdir(directory)[1]:
+                name = f'{directory}/{filename}'
+                if name in in_use or avatar_storage.get_modified_time(name) > cutoff:
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    avatar_storage.delete(name)
+                removed += 1
+
+        verb = "Se borrarían" if options['dry_run'] else "Borrados"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {removed} ficheros sin usar."))
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("registration", "0005_remove_profile_link"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="profile",
+            name="avatar_thumbnail",
+            field=models.ImageField(
+                blank=True, editable=False, null=True, upload_to="profiles/thumbs"
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:49
+
+import registration.models
+import registration.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("registration", "0006_profile_avatar_thumbnail"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="profile",
+            name="avatar",
+            field=models.ImageField(
+                blank=True,
+                null=True,
+                storage=registration.storage.HashedFileSystemStorage(),
+                upload_to=registration.models.custom_upload_to,
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-19 15:56
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("registration", "0007_profile_avatar_storage"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="customuser",
+            index=models.Index(
+                django.db.models.functions.comparison.Collate("username", "NOCASE"),
+                name="registration_username_nc_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customuser",
+            index=models.Index(
+                django.db.models.functions.comparison.Collate("departamento", "NOCASE"),
+                name="registration_depto_nc_idx",
+            ),
+        ),
+    ]
@@ -1,8 +1,12 @@
 # registration/models.py
 from django.db import models
+from django.db.models.functions import Collate
 from django.contrib.auth.models import AbstractUser
-from django.db.models.signals import post_save  
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from .cache import invalidar_usuario
+from .storage import avatar_storage
+from .thumbnails import THUMBNAIL_DIR, schedule_thumbnail, thumbnail_name
 
 # No se necesita el modelo SecurityQuestion porque las preguntas son fijas.
 
@@ -22,26 +26,37 @@ class CustomUser(AbstractUser):
         verbose_name="¿Cuál es el nombre de tu abuela materna?"
     )
 
+    class Meta(AbstractUser.Meta):
+        # La búsqueda de perfiles filtra con LIKE, que en SQLite no distingue mayúsculas:
+        # sólo puede usar índices con la colación NOCASE
+        indexes = [
+            models.Index(Collate('username', 'NOCASE'), name='registration_username_nc_idx'),
+            models.Index(Collate('departamento', 'NOCASE'), name='registration_depto_nc_idx'),
+        ]
+
 def custom_upload_to(instance, filename):
-    # Solo intentamos borrar el avatar antiguo si el objeto ya existe
-    if instance.pk:
-        try:
-            old_instance = Profile.objects.get(pk=instance.pk)
-            if old_instance.avatar:  # Solo si existe avatar anterior
-                old_instance.avatar.delete(save=False)
-        except Profile.DoesNotExist:
-            pass
+    # El almacenamiento cambia el nombre por el hash del contenido (sólo se conserva la
+    # extensión); los avatares antiguos no se borran aquí sino con sweep_avatars
     return 'profiles/' + filename
 
 class Profile(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='profile')
-    avatar = models.ImageField(upload_to=custom_upload_to, null=True, blank=True)
+    avatar = models.ImageField(upload_to=custom_upload_to, storage=avatar_storage, null=True, blank=True)
+    # Miniatura de tamaño fijo del avatar para las listas; se genera en segundo plano
+    avatar_thumbnail = models.ImageField(upload_to=THUMBNAIL_DIR, null=True, blank=True, editable=False)
     bio = models.TextField(null=True, blank=True)
 
 
     class Meta:
         ordering = ['user__username']
 
+    @property
+    def avatar_thumbnail_url(self):
+        # Mientras la miniatura no está lista se usa el avatar original
+        if self.avatar_thumbnail:
+            return self.avatar_thumbnail.url
+        return self.avatar.url if self.avatar else None
+
 # Signal para crear o actualizar el perfil automáticamente
 
 @receiver(post_save, sender=CustomUser)
@@ -49,6 +64,26 @@ def ensure_profile_exists(sender, instance, **kwargs):
         if kwargs.get('created', False):
             # Si el usuario es recién creado, crea un perfil asociado   
             Profile.objects.get_or_create(user=instance)
-            
 
-    
+
+@receiver(post_save, sender=Profile)
+def update_avatar_thumbnail(sender, instance, **kwargs):
+    # El nombre del avatar es el hash de su contenido, así que basta comparar nombres
+    if instance.avatar:
+        if instance.avatar_thumbnail.name != thumbnail_name(instance.avatar.name):
+            schedule_thumbnail(instance)
+    elif instance.avatar_thumbnail:
+        # Se ha quitado el avatar. El fichero puede ser de otro perfil con la misma
+        # imagen, así que no se borra: lo recogerá sweep_avatars
+        Profile.objects.filter(pk=instance.pk).update(avatar_thumbnail=None)
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def invalidar_usuario_en_cache(sender, instance, **kwargs):
+    invalidar_usuario(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Profile)
+def invalidar_perfil_en_cache(sender, instance, **kwargs):
+    # El usuario en caché lleva dentro su perfil
+    invalidar_usuario(instance.user_id)
@@ -0,0 +1,94 @@
+# registration/sessions.py
+from django.conf import settings
+from django.contrib.sessions.backends.cache import SessionStore as CacheStore
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.contrib.sessions.backends.base import VALID_KEY_CHARS, CreateError, UpdateError
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+# Prefijo de las claves de las sesiones guardadas en la base de datos con la caché caída;
+# así un fallo de la caché sólo consulta django_session para esas sesiones
+DB_KEY_PREFIX = 'db'
+
+
+class DBFallbackStore(DBStore):
+    """
+    Sesión en la base de datos con una clave que empieza por DB_KEY_PREFIX.
+    """
+    # La sal de la firma sale del nombre de la clase; se usa la de DBStore para que
+    # las dos lean las mismas filas
+    key_salt = 'django.contrib.sessions.SessionStore'
+
+    def _get_new_session_key(self):
+        while True:
+            session_key = DB_KEY_PREFIX + get_random_string(32 - len(DB_KEY_PREFIX), VALID_KEY_CHARS)
+            if not self.exists(session_key):
+                return session_key
+
+
+class SessionStore(CacheStore):
+    """
+    Sesiones en la caché con la base de datos de respaldo (SESSION_MODE = "cache").
+    Las sesiones se leen y escriben en la caché, así que una petición normal no toca
+    django_session. La base de datos sólo se usa si la caché falla al guardar (la
+    sesión recibe entonces una clave con DB_KEY_PREFIX) y para leer esas sesiones o,
+    con SESSION_CACHE_READ_DB, las de antes de cambiar de modo. Al leerlas se pasan a
+    la caché y se borra la fila para que un logout no deje una copia que la resucite.
+    """
+
+    def load(self):
+        session_key = self.session_key
+        if session_key is None:
+            # Petición sin cookie de sesión: ni caché ni base de datos
+            return {}
+        session_data = super().load()
+        if self.session_key is not None:
+            return session_data
+        if not (session_key.startswith(DB_KEY_PREFIX) or settings.SESSION_CACHE_READ_DB):
+            return {}
+
+        fallback = DBStore(session_key)
+        stored = fallback._get_session_from_db()
+        if stored is None:
+            return {}
+        session_data = fallback.decode(stored.session_data)
+        self._session_key = session_key
+        try:
+            timeout = (stored.expire_date - timezone.now()).total_seconds()
+            self._cache.set(self.cache_key, session_data, max(int(timeout), 1))
+        except Exception:
+            # Sin caché la sesión se sigue sirviendo (y guardando) en la base de datos
+            self._in_db = True
+            return session_data
+        stored.delete()
+        return session_data
+
+    def save(self, must_create=False):
+        if getattr(self, '_in_db', False):
+            return self._save_db(must_create)
+        try:
+            return super().save(must_create)
+        except (CreateError, UpdateError):
+            raise
+        except Exception:
+            # La caché no responde: se guarda en la base de datos hasta que vuelva
+            return self._save_db(must_create)
+
+    def _save_db(self, must_create):
+        # Una sesión de la caché pasa a una clave nueva con el prefijo; la cookie se
+        # actualiza con ella al terminar la petición
+        session_key = self.session_key
+        in_db = session_key is not None and session_key.startswith(DB_KEY_PREFIX)
+        fallback = DBFallbackStore(session_key if in_db else None)
+        fallback._session_cache = self._get_session(no_load=must_create)
+        fallback.save(must_create=must_create)
+        self._session_key = fallback.session_key
+
+    def delete(self, session_key=None):
+        session_key = session_key or self.session_key
+        if getattr(self, '_in_db', False):
+            DBStore().delete(session_key)
+        try:
+            super().delete(session_key)
+        except Exception:
+            DBStore().delete(session_key)
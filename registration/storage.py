@@ -0,0 +1,50 @@
+# registration/storage.py
+import hashlib
+import os
+import re
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# Nombres de fichero direccionados por contenido: el SHA-256 del fichero en hexadecimal
+HASHED_NAME_RE = re.compile(r'(^|/)[0-9a-f]{64}\.\w+$')
+
+# Las URLs de estos ficheros no cambian nunca de contenido, así que se pueden cachear
+# para siempre. En producción el servidor web debe mandar la misma cabecera para media/profiles/
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def content_hash(content):
+    sha = hashlib.sha256()
+    for chunk in content.chunks():
+        sha.update(chunk)
+    return sha.hexdigest()
+
+
+@deconstructible
+class HashedFileSystemStorage(FileSystemStorage):
+    """
+    Guarda cada fichero con el hash de su contenido como nombre, en la carpeta que
+    indique upload_to. Dos subidas iguales comparten fichero y un avatar nuevo nunca
+    pisa al anterior; los que se quedan sin usar los borra sweep_avatars.
+    """
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, content_hash(content) + extension).replace('\\', '/')
+        if self.exists(name):
+            # Ya lo tenemos; se actualiza la fecha para que sweep_avatars no lo dé por
+            # abandonado mientras se guarda el perfil que lo va a usar
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
+
+
+def is_immutable(name):
+    return bool(HASHED_NAME_RE.search(name))
+
+
+avatar_storage = HashedFileSystemStorage()
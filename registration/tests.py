@@ -1,9 +1,28 @@
 
-from django.test import TestCase, Client
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter
+from io import BytesIO, StringIO
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore as DBSessionStore
+from django.contrib.sessions.models import Session
+from django.test import TestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
-from django.contrib.auth import get_user_model
+from django.contrib.auth import BACKEND_SESSION_KEY, get_user_model
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from PIL import Image
 from .models import CustomUser, Profile
-from .forms import CustomUserCreationForm, EmailForm, ForgotPasswordForm
+from .forms import CustomUserCreationForm, CustomUserUpdateForm, ForgotPasswordForm
+from .backends import ProfileBackend
+from .sessions import DB_KEY_PREFIX, SessionStore as CacheDBSessionStore
+from .storage import IMMUTABLE_CACHE_CONTROL
+from .throttle import TokenBucket
+from .thumbnails import THUMBNAIL_SIZE, thumbnail_name
+from .views import serve_media
 from unittest.mock import patch
 
 
@@ -91,7 +110,7 @@ class RegistrationTests(TestCase):
         # Crear un segundo usuario para tener un email duplicado
         User.objects.create_user(username='otheruser', email='other@example.com', password='password')
         # Intentar actualizar el email del usuario de prueba al email del otro usuario
-        form = EmailForm(data={'email': 'other@example.com'}, instance=self.user)
+        form = CustomUserUpdateForm(data={'email': 'other@example.com'}, instance=self.user)
         self.assertFalse(form.is_valid())
         self.assertIn('email', form.errors)
 
@@ -149,4 +168,295 @@ class RegistrationTests(TestCase):
         
         self.assertRedirects(response, reverse('password_reset_confirm'))
         self.assertEqual(response.status_code, 200)
-        self.assertTemplateUsed(response, 'registration/password_reset_confirm.html')
\ No newline at end of file
+        self.assertTemplateUsed(response, 'registration/password_reset_confirm.html')
+
+
+class AvatarThumbnailTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.profile = CustomUser.objects.create_user('avatar', 'avatar@test.com', 'test1234').profile
+
+    def imagen(self, nombre='foto.png', size=(400, 300)):
+        output = BytesIO()
+        Image.new('RGB', size, 'red').save(output, 'PNG')
+        return SimpleUploadedFile(nombre, output.getvalue(), content_type='image/png')
+
+    def subir_avatar(self, imagen):
+        # El grupo de hilos se sustituye por una llamada directa para esperar al resultado
+        with patch('registration.thumbnails.executor.submit', side_effect=lambda fn, *args: fn(*args)), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.profile.avatar = imagen
+            self.profile.save()
+        self.profile.refresh_from_db()
+
+    def test_miniatura_al_subir_avatar(self):
+        self.subir_avatar(self.imagen())
+        self.assertEqual(self.profile.avatar_thumbnail.name, thumbnail_name(self.profile.avatar.name))
+        self.assertEqual(self.profile.avatar_thumbnail_url, self.profile.avatar_thumbnail.url)
+        with default_storage.open(self.profile.avatar_thumbnail.name) as thumbnail, Image.open(thumbnail) as image:
+            self.assertEqual(image.size, THUMBNAIL_SIZE)
+
+    def test_sin_miniatura_se_usa_el_avatar(self):
+        with patch('registration.thumbnails.executor.submit') as submit, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.profile.avatar = self.imagen()
+            self.profile.save()
+        submit.assert_called_once()
+        self.assertEqual(self.profile.avatar_thumbnail_url, self.profile.avatar.url)
+
+    def test_quitar_avatar_quita_la_miniatura(self):
+        self.subir_avatar(self.imagen())
+        name = self.profile.avatar_thumbnail.name
+        self.profile.avatar = None
+        self.profile.save()
+        self.profile.refresh_from_db()
+        self.assertFalse(self.profile.avatar_thumbnail)
+        self.assertIsNone(self.profile.avatar_thumbnail_url)
+        # El fichero no se borra al momento: lo recoge sweep_avatars
+        self.assertTrue(default_storage.exists(name))
+
+    def test_avatar_por_hash_del_contenido(self):
+        self.subir_avatar(self.imagen('alba.PNG'))
+        first = self.profile.avatar.name
+        self.assertRegex(first, r'^profiles/[0-9a-f]{64}\.png$')
+
+        # La misma imagen subida por otro usuario (o con otro nombre) se guarda una vez
+        other = CustomUser.objects.create_user('otro', 'otro@test.com', 'test1234').profile
+        other.avatar = self.imagen('copia.png')
+        with self.captureOnCommitCallbacks():
+            other.save()
+        self.assertEqual(other.avatar.name, first)
+        self.assertEqual(len(default_storage.listdir('profiles')[1]), 1)
+
+        # Un avatar nuevo no pisa ni borra el anterior
+        self.subir_avatar(self.imagen('alba.png', size=(200, 200)))
+        self.assertNotEqual(self.profile.avatar.name, first)
+        self.assertTrue(default_storage.exists(first))
+
+    def test_sweep_avatars(self):
+        self.subir_avatar(self.imagen())
+        viejo = self.profile.avatar.name
+        self.subir_avatar(self.imagen(size=(200, 200)))
+        reciente = default_storage.save('profiles/reciente.png', self.imagen())
+        # Todo lo que no sea el reciente pasa a tener dos días
+        hace_dos_dias = time.time() - 2 * 86400
+        for directory in ('profiles', 'profiles/thumbs'):
+            for filename in default_storage.listdir(directory)[1]:
+                if f'{directory}/{filename}' != reciente:
+                    os.utime(default_storage.path(f'{directory}/{filename}'), (hace_dos_dias, hace_dos_dias))
+
+        call_command('sweep_avatars', stdout=StringIO())
+        self.assertFalse(default_storage.exists(viejo))
+        self.assertFalse(default_storage.exists(thumbnail_name(viejo)))
+        self.assertTrue(default_storage.exists(reciente))
+        self.assertTrue(default_storage.exists(self.profile.avatar.name))
+        self.assertTrue(default_storage.exists(self.profile.avatar_thumbnail.name))
+
+    def test_url_inmutable(self):
+        self.subir_avatar(self.imagen())
+        request = RequestFactory().get('/')
+        response = serve_media(request, self.profile.avatar_thumbnail.name, document_root=settings.MEDIA_ROOT)
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+
+    def test_rebuild_avatars(self):
+        self.subir_avatar(self.imagen())
+        Profile.objects.filter(pk=self.profile.pk).update(avatar_thumbnail=None)
+        call_command('rebuild_avatars', workers=1, stdout=StringIO())
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_thumbnail.name, thumbnail_name(self.profile.avatar.name))
+        self.assertTrue(default_storage.exists(self.profile.avatar_thumbnail.name))
+
+
+class ThrottleTestCase(TestCase):
+    def setUp(self):
+        self.now = 0
+        self.bucket = TokenBucket(rate=1, burst=3, clock=lambda: self.now)
+        patcher = patch('registration.throttle.bucket', self.bucket)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        CustomUser.objects.create_user('victima', 'victima@test.com', 'test1234')
+
+    def test_token_bucket(self):
+        self.assertEqual([self.bucket.consume('a') for _ in range(4)], [0, 0, 0, 1])
+        # Las claves no comparten cubo
+        self.assertEqual(self.bucket.consume('b'), 0)
+        # Medio segundo después sigue faltando media ficha
+        self.now = 0.5
+        self.assertEqual(self.bucket.consume('a'), 0.5)
+        self.now = 1
+        self.assertEqual(self.bucket.consume('a'), 0)
+
+    def test_login_limitado_por_usuario(self):
+        datos = {'username': 'victima', 'password': 'mala'}
+        for i in range(3):
+            response = self.client.post(reverse('login'), datos, REMOTE_ADDR=f'10.0.0.{i}')
+            self.assertEqual(response.status_code, 200)
+        # Cambiar de IP no sirve: el cubo del usuario está vacío
+        response = self.client.post(reverse('login'), datos, REMOTE_ADDR='10.0.0.9')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '2')
+        # Los GET no gastan fichas
+        self.assertEqual(self.client.get(reverse('login'), REMOTE_ADDR='10.0.0.9').status_code, 200)
+
+    def test_login_correcto_no_gasta_fichas_del_usuario(self):
+        datos = {'username': 'victima', 'password': 'test1234'}
+        for i in range(5):
+            response = self.client.post(reverse('login'), datos, REMOTE_ADDR=f'10.0.0.{i}')
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.bucket.wait('user:victima'), 0)
+
+    def test_cubo_del_usuario_vacio_no_gasta_la_ip(self):
+        for i in range(3):
+            self.client.post(reverse('login'), {'username': 'victima', 'password': 'mala'}, REMOTE_ADDR=f'10.0.0.{i}')
+        response = self.client.post(reverse('login'), {'username': 'victima', 'password': 'mala'}, REMOTE_ADDR='10.0.0.9')
+        self.assertEqual(response.status_code, 429)
+        # La IP rechazada conserva todas sus fichas para otros usuarios
+        self.assertNotIn('ip:10.0.0.9', self.bucket.buckets)
+
+    def test_reset_limitado_por_ip(self):
+        for i in range(3):
+            self.client.post(reverse('password_reset_username'), {'username': f'usuario{i}'})
+        response = self.client.post(reverse('password_reset_username'), {'username': 'otro'})
+        self.assertEqual(response.status_code, 429)
+
+    def test_contadores(self):
+        staff = CustomUser.objects.create_user('staff', 'staff@test.com', 'test1234', is_staff=True)
+        self.client.force_login(staff)
+        with patch('registration.throttle.stats', Counter()) as contadores:
+            for _ in range(4):
+                self.client.post(reverse('password_reset_username'), {'username': 'victima'})
+            self.assertEqual(self.client.get(reverse('throttle_stats')).json(), {
+                'password_reset_username:allowed': 3,
+                'password_reset_username:throttled': 1,
+            })
+
+
+class ProvisionUsersTestCase(TestCase):
+    def setUp(self):
+        CustomUser.objects.create_user('existente', 'existente@test.com', 'test1234')
+        csv_file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8')
+        self.addCleanup(os.remove, csv_file.name)
+        csv_file.write(
+            "username,email,password,departamento,is_staff\n"
+            "ana,ana@test.com,secreto123,IT,1\n"
+            "luis,luis@test.com,,Finanzas,\n"
+            "ana,otra@test.com,secreto123,IT,\n"
+            "existente,nuevo@test.com,secreto123,IT,\n"
+        )
+        csv_file.close()
+        self.path = csv_file.name
+
+    def test_provision_users(self):
+        stderr = StringIO()
+        call_command('provision_users', self.path, workers=1, stdout=StringIO(), stderr=stderr)
+        # Las filas repetidas o ya existentes se saltan y se avisa de ellas
+        self.assertIn("Línea 4", stderr.getvalue())
+        self.assertIn("Línea 5", stderr.getvalue())
+
+        ana = CustomUser.objects.get(username='ana')
+        self.assertTrue(ana.check_password('secreto123'))
+        self.assertTrue(ana.is_staff)
+        self.assertEqual(ana.departamento, 'IT')
+        self.assertFalse(CustomUser.objects.get(username='luis').has_usable_password())
+        # Los perfiles se crean en bloque aunque bulk_create no lance post_save
+        self.assertEqual(Profile.objects.filter(user__username__in=['ana', 'luis']).count(), 2)
+
+    def test_email_existente_sin_distinguir_mayusculas(self):
+        CustomUser.objects.create_user('ana_antigua', 'Ana@Test.com', 'test1234')
+        stderr = StringIO()
+        call_command('provision_users', self.path, workers=1, stdout=StringIO(), stderr=stderr)
+        self.assertIn("Línea 2", stderr.getvalue())
+        self.assertFalse(CustomUser.objects.filter(username='ana').exists())
+
+
+class SessionModeTestCase(TestCase):
+    def setUp(self):
+        CustomUser.objects.create_user('ana', 'ana@test.com', 'test1234',
+                                       respuesta_seguridad_1='Milo', respuesta_seguridad_2='María')
+
+    def test_restablecimiento_en_cada_modo(self):
+        for engine in ('django.contrib.sessions.backends.signed_cookies', 'registration.sessions'):
+            with self.subTest(engine=engine), self.settings(SESSION_ENGINE=engine):
+                client = Client()
+                client.post(reverse('password_reset_username'), {'username': 'ana'})
+                # Falla la primera pregunta: el paso 2 tiene que sobrevivir entre peticiones
+                response = client.post(reverse('password_reset_question'), {'respuesta_seguridad_1': 'Toby'})
+                self.assertEqual(response.context['question_step'], 2)
+                response = client.post(reverse('password_reset_question'), {'respuesta_seguridad_2': 'María'})
+                self.assertRedirects(response, reverse('password_reset_confirm'))
+                response = client.post(reverse('password_reset_confirm'), {
+                    'new_password1': 'Otra-clave-9', 'new_password2': 'Otra-clave-9',
+                })
+                self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+                self.assertTrue(CustomUser.objects.get(username='ana').check_password('Otra-clave-9'))
+        self.assertFalse(Session.objects.exists())
+
+    def test_cache_sin_sesion_no_consulta_la_base_de_datos(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(CacheDBSessionStore().load(), {})
+            self.assertEqual(CacheDBSessionStore('x' * 32).load(), {})
+
+    @override_settings(SESSION_CACHE_READ_DB=True)
+    def test_cache_lee_las_sesiones_de_la_base_de_datos(self):
+        anterior = DBSessionStore()
+        anterior['temp_username'] = 'ana'
+        anterior.create()
+
+        session = CacheDBSessionStore(anterior.session_key)
+        self.assertEqual(session['temp_username'], 'ana')
+        # La sesión pasa a la caché y la fila desaparece
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(CacheDBSessionStore(anterior.session_key)['temp_username'], 'ana')
+
+    def test_cache_caida_guarda_en_la_base_de_datos(self):
+        session = CacheDBSessionStore()
+        session['temp_username'] = 'ana'
+        with patch.object(session._cache, 'add', side_effect=ConnectionError):
+            session.save()
+        self.assertTrue(session.session_key.startswith(DB_KEY_PREFIX))
+        self.assertEqual(DBSessionStore(session.session_key)['temp_username'], 'ana')
+        # Al volver la caché la sesión se recupera aunque no se lea django_session en general
+        self.assertEqual(CacheDBSessionStore(session.session_key)['temp_username'], 'ana')
+        self.assertFalse(Session.objects.exists())
+
+
+class ProfileBackendTestCase(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('ana', 'ana@test.com', 'test1234')
+        self.backend = ProfileBackend()
+
+    def test_usuario_con_perfil_en_una_consulta(self):
+        with self.assertNumQueries(1):
+            user = self.backend.get_user(self.user.pk)
+            self.assertFalse(user.profile.avatar)
+
+    def test_sesion_iniciada_con_model_backend_sigue_valiendo(self):
+        self.client.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(self.client.session[BACKEND_SESSION_KEY], 'django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+
+    @override_settings(AUTH_USER_CACHE_TIMEOUT=30)
+    def test_cache_invalidada_al_actualizar_el_perfil(self):
+        self.backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.backend.get_user(self.user.pk).profile.bio, None)
+
+        self.client.force_login(self.user)
+        self.client.post(reverse('profile'), {
+            'username': 'ana', 'email': 'ana@test.com', 'telefono': '1', 'departamento': 'IT',
+            'respuesta_seguridad_1': 'a', 'respuesta_seguridad_2': 'b', 'bio': 'Hola',
+        })
+        self.assertEqual(self.backend.get_user(self.user.pk).profile.bio, 'Hola')
+
+    @override_settings(AUTH_USER_CACHE_TIMEOUT=30)
+    def test_cache_invalidada_al_cambiar_la_contrasena(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+        self.user.set_password('nueva-clave-1')
+        self.user.save()
+        # La sesión anterior deja de valer en lugar de sobrevivir con el usuario en caché
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 302)
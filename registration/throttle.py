@@ -0,0 +1,153 @@
+# registration/throttle.py
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+# Claves que guarda como mucho el almacén en memoria; al pasarse se olvidan los cubos
+# que ya se han vuelto a llenar, que equivalen a no tener entrada
+MAX_KEYS = 10000
+
+# Contadores por vista y resultado ("login:allowed", "login:throttled"...) para la
+# monitorización. Son de este proceso: cada worker lleva los suyos
+stats = Counter()
+stats_lock = threading.Lock()
+
+
+def refill(state, now, rate, burst):
+    """
+    Devuelve las fichas disponibles ahora a partir del estado guardado (fichas, instante).
+    """
+    if state is None:
+        return burst
+    tokens, stamp = state
+    return min(burst, tokens + (now - stamp) * rate)
+
+
+class TokenBucket:
+    """
+    Cubo de fichas por clave: admite ráfagas de `burst` intentos y se rellena a razón
+    de `rate` fichas por segundo. Con `use_cache` el estado se guarda en la caché de
+    Django para compartirlo entre procesos; la lectura y escritura no son atómicas, así
+    que con mucha concurrencia sobre la misma clave el límite es aproximado.
+    """
+
+    def __init__(self, rate, burst, use_cache=False, prefix='throttle', clock=None):
+        self.rate = rate
+        self.burst = burst
+        self.use_cache = use_cache
+        self.prefix = prefix
+        # En la caché se comparte el estado entre máquinas, así que hace falta la hora
+        # real; en memoria basta el reloj monótono
+        self.clock = clock or (time.time if use_cache else time.monotonic)
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def consume(self, key):
+        """
+        Gasta una ficha de la clave. Devuelve 0 si se admite el intento o los segundos
+        que faltan para la siguiente ficha si no.
+        """
+        if self.use_cache:
+            return self._consume_cache(f'{self.prefix}:{key}')
+        with self.lock:
+            now = self.clock()
+            tokens = refill(self.buckets.get(key), now, self.rate, self.burst)
+            wait = self._take(tokens)
+            self.buckets[key] = (tokens - 1 if not wait else tokens, now)
+            if len(self.buckets) > MAX_KEYS:
+                self._prune(now)
+            return wait
+
+    def wait(self, key):
+        """
+        Devuelve los segundos que faltan para que la clave tenga una ficha, sin gastarla.
+        """
+        if self.use_cache:
+            return self._take(refill(cache.get(f'{self.prefix}:{key}'), self.clock(), self.rate, self.burst))
+        with self.lock:
+            return self._take(refill(self.buckets.get(key), self.clock(), self.rate, self.burst))
+
+    def _consume_cache(self, key):
+        now = self.clock()
+        tokens = refill(cache.get(key), now, self.rate, self.burst)
+        wait = self._take(tokens)
+        # La entrada caduca cuando el cubo estaría lleno otra vez
+        cache.set(key, (tokens - 1 if not wait else tokens, now), timeout=int(self.burst / self.rate) + 1)
+        return wait
+
+    def _take(self, tokens):
+        return 0 if tokens >= 1 else (1 - tokens) / self.rate
+
+    def _prune(self, now):
+        self.buckets = {
+            key: state for key, state in self.buckets.items()
+            if refill(state, now, self.rate, self.burst) < self.burst
+        }
+
+
+bucket = TokenBucket(settings.LOGIN_THROTTLE_RATE, settings.LOGIN_THROTTLE_BURST,
+                     use_cache=settings.LOGIN_THROTTLE_USE_CACHE)
+
+
+def client_ip(request):
+    # En la intranet no hay proxy delante: REMOTE_ADDR es la IP del cliente
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def count(scope, result):
+    with stats_lock:
+        stats[f'{scope}:{result}'] += 1
+
+
+def snapshot():
+    with stats_lock:
+        return dict(stats)
+
+
+def throttle(scope, get_username):
+    """
+    Limita los POST de la vista por IP y por nombre de usuario (lo que devuelva
+    `get_username(request)`) antes de calcular ningún hash ni consultar la base de
+    datos. Primero se comprueba que los dos cubos tienen ficha y sólo entonces se gasta
+    la de la IP; la del usuario se gasta después y sólo si el intento falla (la vista
+    vuelve a mostrar el formulario), para que nadie pueda dejar sin intentos a otro
+    usuario con peticiones correctas. Si no quedan fichas responde un 429 de texto,
+    sin plantilla.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'POST':
+                return view(request, *args, **kwargs)
+            ip_key = f'ip:{client_ip(request)}'
+            username = get_username(request)
+            user_key = f'user:{username.strip().lower()}' if username else None
+            wait = max(bucket.wait(key) for key in (ip_key, user_key) if key)
+            if not wait:
+                wait = bucket.consume(ip_key)
+            if wait:
+                count(scope, 'throttled')
+                response = HttpResponse("Demasiados intentos. Vuelva a intentarlo más tarde.",
+                                        status=429, content_type='text/plain; charset=utf-8')
+                response['Retry-After'] = str(int(wait) + 1)
+                return response
+            count(scope, 'allowed')
+            response = view(request, *args, **kwargs)
+            # Un intento correcto acaba en una redirección al siguiente paso
+            if user_key and response.status_code == 200:
+                bucket.consume(user_key)
+            return response
+        return wrapper
+    return decorator
+
+
+def posted_username(request):
+    return request.POST.get('username')
+
+
+def session_username(request):
+    return request.session.get('temp_username')
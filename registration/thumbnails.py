@@ -0,0 +1,87 @@
+# registration/thumbnails.py
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps, features
+
+# Tamaño fijo de las miniaturas (el doble de lo que ocupan en las listas, para pantallas de alta densidad)
+THUMBNAIL_SIZE = (128, 128)
+
+# WebP si Pillow lo soporta; si no, JPEG
+THUMBNAIL_FORMAT, THUMBNAIL_EXTENSION = ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+THUMBNAIL_QUALITY = 80
+
+# Carpeta (dentro de MEDIA_ROOT) donde se guardan las miniaturas
+THUMBNAIL_DIR = 'profiles/thumbs'
+
+# Las miniaturas se generan fuera de la petición en este grupo de hilos
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='avatars')
+
+
+def thumbnail_name(avatar_name):
+    """
+    Devuelve el nombre de la miniatura de un avatar. Depende sólo del nombre del
+    avatar (el hash de su contenido), así que basta compararlo para saber si la
+    miniatura está al día y dos avatares iguales comparten miniatura.
+    """
+    stem = os.path.splitext(os.path.basename(avatar_name))[0]
+    return f'{THUMBNAIL_DIR}/{stem}.{THUMBNAIL_EXTENSION}'
+
+
+def render_thumbnail(image_file):
+    """
+    Devuelve los bytes de la miniatura recortada al tamaño fijo, respetando la
+    orientación EXIF de las fotos de móvil.
+    """
+    with Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image)
+        # JPEG no admite transparencia; WebP la conserva si la imagen la tiene
+        image = image.convert('RGBA' if THUMBNAIL_FORMAT == 'WEBP' and 'A' in image.getbands() else 'RGB')
+        thumbnail = ImageOps.fit(image, THUMBNAIL_SIZE, Image.LANCZOS)
+        output = BytesIO()
+        thumbnail.save(output, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+    return output.getvalue()
+
+
+def write_thumbnail(avatar_name, storage=default_storage, force=False):
+    """
+    Genera y guarda la miniatura de un avatar y devuelve su nombre. Si ya existe no se
+    vuelve a generar salvo con `force`. Sólo toca ficheros, así que se puede llamar
+    desde otro proceso (rebuild_avatars).
+    """
+    name = thumbnail_name(avatar_name)
+    if storage.exists(name):
+        if not force:
+            # Se renueva la fecha para que sweep_avatars no la borre antes de guardarla
+            os.utime(storage.path(name))
+            return name
+        storage.delete(name)
+    with storage.open(avatar_name, 'rb') as avatar:
+        data = render_thumbnail(avatar)
+    return storage.save(name, ContentFile(data))
+
+
+def generate_thumbnail(profile_pk, avatar_name):
+    """
+    Genera la miniatura y la guarda en el perfil, siempre que el avatar no haya
+    cambiado mientras tanto. Se ejecuta en el grupo de hilos.
+    """
+    from .models import Profile
+    try:
+        name = write_thumbnail(avatar_name)
+        Profile.objects.filter(pk=profile_pk, avatar=avatar_name).update(avatar_thumbnail=name)
+        return name
+    finally:
+        # Cada hilo del grupo abre su propia conexión; la cerramos al terminar
+        connections.close_all()
+
+
+def schedule_thumbnail(profile):
+    """
+    Encarga la miniatura del avatar del perfil cuando se confirme la transacción.
+    """
+    args = (profile.pk, profile.avatar.name)
+    transaction.on_commit(lambda: executor.submit(generate_thumbnail, *args))
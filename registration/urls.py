@@ -1,7 +1,10 @@
 from django.urls import path
-from .views import SignUpView, password_reset_username, password_reset_question, password_reset_confirm, profile_update
+from .views import SignUpView, login, password_reset_username, password_reset_question, password_reset_confirm, profile_update, throttle_stats
 
 urlpatterns=[
+    # Sustituye al login de django.contrib.auth.urls (se incluye antes) para limitar los intentos
+    path('login/', login, name='login'),
+    path('throttle/', throttle_stats, name='throttle_stats'),
     path('signup/', SignUpView.as_view(), name='signup'),
     path('reset/', password_reset_username, name='password_reset_username'),
     path('reset/question/', password_reset_question, name='password_reset_question'),
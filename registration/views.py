@@ -4,12 +4,18 @@ from django import forms
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import SetPasswordForm
+from django.contrib.auth.views import LoginView
 from django.views.generic import CreateView
 from django.views.generic.edit import UpdateView
 from django.utils.decorators import method_decorator
 from django.urls import reverse_lazy
+from django.views.static import serve
+from django.http import JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from .models import Profile
+from .storage import IMMUTABLE_CACHE_CONTROL, is_immutable
+from .throttle import posted_username, session_username, snapshot, throttle
 from django.contrib.auth.decorators import login_required
 from .forms import CustomUserCreationForm, ForgotPasswordForm, ProfileForm, CustomUserUpdateForm
 
@@ -41,6 +47,11 @@ class SignUpView(CreateView):
         return form
 
 
+# Cada intento cuesta un hash PBKDF2 o consultas a la base de datos: se limitan por IP y usuario
+login = throttle('login', posted_username)(LoginView.as_view())
+
+
+@throttle('password_reset_username', posted_username)
 def password_reset_username(request):
     """
     Paso 1: Solicita el nombre de usuario para iniciar el proceso.
@@ -57,6 +68,7 @@ def password_reset_username(request):
         
     return render(request, 'registration/password_reset_username.html', {'form': form})
 
+@throttle('password_reset_question', session_username)
 def password_reset_question(request):
     """
     Paso 2: Muestra las preguntas de seguridad secuencialmente y verifica las respuestas.
@@ -123,7 +135,11 @@ def password_reset_confirm(request):
 @login_required
 def profile_update(request):
     # Aseguramos que el usuario tenga un objeto de perfil. Si no lo tiene, lo creamos.
-    profile_instance, created = Profile.objects.get_or_create(user=request.user)
+    # ProfileBackend ya lo trae con el usuario, así que normalmente no hay consulta
+    try:
+        profile_instance = request.user.profile
+    except Profile.DoesNotExist:
+        profile_instance = Profile.objects.create(user=request.user)
 
     if request.method == 'POST':
         # Instanciamos ambos formularios con los datos enviados por el usuario
@@ -149,4 +165,23 @@ def profile_update(request):
 
     return render(request, 'registration/profile_form.html', context)
     
-    
\ No newline at end of file
+    
+
+def serve_media(request, path, document_root=None):
+    """
+    Sirve MEDIA en desarrollo. Los avatares y miniaturas se nombran por el hash de su
+    contenido, así que su URL nunca cambia de contenido y el navegador puede cachearla
+    para siempre.
+    """
+    response = serve(request, path, document_root=document_root)
+    if is_immutable(path):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+@staff_member_required
+def throttle_stats(request):
+    """
+    Contadores de intentos admitidos y rechazados por vista, para la monitorización.
+    """
+    return JsonResponse(snapshot())